@@ -0,0 +1,501 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import secrets
+import tempfile
+import time
+
+from aiohttp import web
+from typing import Callable, Dict, List, Tuple
+
+import config
+
+# Offline benchmarks: a fake MediaWiki api.php and a fake BingoSync serve
+# synthetic data on localhost, and the bot's own code paths are timed against
+# them with cold and warm caches.
+
+MEMBER_TIMESTAMP = "2024-01-01T00:00:00Z"
+
+
+class FakeWiki:
+    # Categories "Bench N" with `size` pages each and `subcats` subcategories
+    # "Bench N.M" of a quarter the size. Articles are "Article N". Every 50th
+    # page is a list page and every 97th a redirect, so flagging has work to do.
+
+    def __init__(self, categories: int, size: int, subcats: int, latency: float):
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self.categories = {}
+
+        for i in range(categories):
+            children = [f"Bench {i}.{k}" for k in range(subcats)]
+            self.categories[f"Bench {i}"] = self._members(f"Bench {i}", size, children)
+
+            for child in children:
+                self.categories[child] = self._members(child, max(size // 4, 1), [])
+
+    @staticmethod
+    def _members(name: str, size: int, children: List[str]) -> List[dict]:
+        members = [
+            {
+                "ns": 0,
+                "title": f"List of {name} things {j}" if j % 50 == 49 else f"{name} page {j}",
+                "redirect": j % 97 == 96,
+            }
+            for j in range(size)
+        ]
+        members.extend({"ns": 14, "title": f"Category:{child}"} for child in children)
+
+        return members
+
+    def _count(self, kind: str):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    @staticmethod
+    def _page(params, prefix: str, members: List[dict]):
+        # Offset-based continuation, like the real cmcontinue in spirit.
+        limit = params.get(prefix + "limit", "max")
+        limit = 500 if limit == "max" else int(limit)
+        offset = int(params.get(prefix + "continue", 0))
+
+        if params.get(prefix + "sort") == "timestamp" and params.get(prefix + "dir") != "descending":
+            if params.get(prefix + "start", "") > MEMBER_TIMESTAMP:
+                members = []
+
+        return (members[offset : offset + limit], offset + limit)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+
+        params = request.query
+        query = {}
+        more = {}
+
+        if params.get("generator") == "categorymembers":
+            self._count("category members")
+            members = self.categories.get(params["gcmtitle"].removeprefix("Category:"), [])
+            (batch, next_offset) = self._page(params, "gcm", members)
+
+            query["pages"] = [
+                {
+                    "ns": member["ns"],
+                    "title": member["title"],
+                    **({"redirect": True} if member.get("redirect") else {}),
+                }
+                for member in batch
+            ]
+
+            if next_offset < len(members) and len(batch) > 0:
+                more = {"gcmcontinue": str(next_offset), "continue": "gcmcontinue||"}
+
+        elif params.get("list") == "categorymembers":
+            self._count("category state" if params.get("cmlimit") == "1" else "category members")
+            members = self.categories.get(params["cmtitle"].removeprefix("Category:"), [])
+            (batch, next_offset) = self._page(params, "cm", members)
+
+            query["categorymembers"] = [
+                {
+                    "title": member["title"],
+                    "type": "subcat" if member["ns"] == 14 else "page",
+                    "timestamp": MEMBER_TIMESTAMP,
+                }
+                for member in batch
+            ]
+
+            if next_offset < len(members) and len(batch) > 0:
+                more = {"cmcontinue": str(next_offset), "continue": "-||"}
+
+        elif "titles" not in params:
+            return web.json_response({"error": {"code": "badparams"}})
+        else:
+            self._count("title lookup")
+
+        if "titles" in params and params.get("prop") == "categoryinfo":
+            query["pages"] = [self._title_info(title) for title in params["titles"].split("|")]
+
+        js = {"batchcomplete": True, "query": query}
+        if more:
+            js["continue"] = more
+
+        return web.json_response(js)
+
+    def _title_info(self, title: str) -> dict:
+        name = title.removeprefix("Category:")
+
+        if title.startswith("Category:"):
+            members = self.categories.get(name)
+
+            if members is None:
+                return {"title": title, "missing": True}
+
+            return {
+                "title": title,
+                "categoryinfo": {
+                    "pages": sum(member["ns"] != 14 for member in members),
+                    "subcats": sum(member["ns"] == 14 for member in members),
+                    "size": len(members),
+                },
+            }
+
+        if title.startswith("Article "):
+            return {"title": title, "pageid": 1}
+
+        return {"title": title, "missing": True}
+
+
+class FakeBingoSync:
+    # Hands out a CSRF token with the form, and answers a POST carrying it
+    # with a redirect to a new room.
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self.tokens = set()
+        self.rooms = 0
+
+    def _count(self, kind: str):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    async def handle_get(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        self._count("GET")
+
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+
+        resp = web.Response(
+            text=(
+                "<html><body><form method='post'>"
+                f'<input type="hidden" name="csrfmiddlewaretoken" value="{token}">'
+                "</form></body></html>"
+            ),
+            content_type="text/html",
+        )
+        resp.set_cookie("csrftoken", token)
+
+        return resp
+
+    async def handle_post(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        self._count("POST")
+
+        form = await request.post()
+
+        if form.get("csrfmiddlewaretoken") not in self.tokens:
+            return web.Response(status=403, text="CSRF verification failed.")
+
+        self.rooms += 1
+
+        return web.Response(status=302, headers={"Location": f"/room/bench{self.rooms}"})
+
+
+class FakeMessage:
+    async def edit(self, content: str = None):
+        pass
+
+
+class FakeSnowflake:
+    # Anything discord.py identifies by id: users, channels, guilds.
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeContext:
+    # Just enough of a discord.py command context for the command handlers.
+
+    def __init__(self, author_id: int = 0, channel_id: int = 0):
+        self.author = FakeSnowflake(author_id)
+        self.channel = FakeSnowflake(channel_id)
+        self.sent = []
+
+    async def send(self, content: str = None):
+        self.sent.append(content)
+
+        return FakeMessage()
+
+
+async def _serve(app: web.Application) -> Tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    (host, port) = runner.addresses[0][:2]
+
+    return (runner, f"http://{host}:{port}")
+
+
+async def start_servers(fake_wiki: FakeWiki, fake_bingosync: FakeBingoSync):
+    # Each on its own port, so BingoSync requests don't go through the wiki
+    # rate limiter and are counted under their own host. Returns the runners
+    # to clean up and the two base URLs.
+    wiki_app = web.Application()
+    wiki_app.router.add_get("/w/api.php", fake_wiki.handle)
+
+    bingosync_app = web.Application()
+    bingosync_app.router.add_get("/", fake_bingosync.handle_get)
+    bingosync_app.router.add_post("/", fake_bingosync.handle_post)
+
+    (wiki_runner, wiki_url) = await _serve(wiki_app)
+    (bingosync_runner, bingosync_url) = await _serve(bingosync_app)
+
+    return ([wiki_runner, bingosync_runner], wiki_url, bingosync_url)
+
+
+async def stop_servers(runners: List[web.AppRunner]):
+    for runner in runners:
+        await runner.cleanup()
+
+
+def use_stand_ins(wiki_url: str, bingosync_url: str, **overrides):
+    # Points the bot's settings at the servers from start_servers. Must run
+    # before db and friends are imported.
+    config.override(
+        wiki_api_url=f"{wiki_url}/w/api.php",
+        bingosync_url=f"{bingosync_url}/",
+        category_depth=1,
+        category_max_members=0,
+        **overrides,
+    )
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    # Nearest-rank percentile.
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+
+    return ordered[index]
+
+
+def _is_scratch_file(path: str) -> bool:
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+
+    return os.path.commonpath([os.path.realpath(path), temp_dir]) == temp_dir
+
+
+def copy_db(path: str, tmpdir: str) -> str:
+    # A consistent copy (WAL included) to benchmark against, so the original
+    # is never written to.
+    import sqlite3
+
+    copy_path = os.path.join(tmpdir, "bench.db")
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    target = sqlite3.connect(copy_path)
+
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+    return copy_path
+
+
+def reset_caches():
+    # Empties everything the bot has cached, in the database and in memory,
+    # while keeping every thread's open connection valid. Only ever done to a
+    # database in the temporary directory.
+    import board
+    import db
+
+    if not _is_scratch_file(db.DB_FILE):
+        raise RuntimeError(f"refusing to empty {db.DB_FILE}, it isn't a temporary file")
+
+    conn = db.connection()
+
+    with conn:
+        for table in (
+            "PresetMembership",
+            "Presets",
+            "PresetEntries",
+            "EntryLookups",
+            "CategoryCache",
+            "Pages",
+        ):
+            conn.execute(f"DELETE FROM {table}")
+
+    db._preset_cache.clear()
+    db._category_cache.clear()
+
+    board._pools.clear()
+    board._generations.clear()
+
+
+def _request_counts(servers: List) -> Dict[str, int]:
+    return {kind: count for server in servers for kind, count in server.requests.items()}
+
+
+async def measure(
+    name: str,
+    phase: str,
+    iterations: int,
+    setup: Callable,
+    operation: Callable,
+    servers: List,
+) -> dict:
+    # Only requests made during the timed operation are counted, not setup's.
+    latencies = []
+    requests = {}
+    total = 0.0
+
+    for _ in range(iterations):
+        await setup()
+
+        before = _request_counts(servers)
+        started = time.perf_counter()
+        await operation()
+        elapsed = time.perf_counter() - started
+
+        for kind, count in _request_counts(servers).items():
+            if count != before.get(kind, 0):
+                requests[kind] = requests.get(kind, 0) + count - before.get(kind, 0)
+
+        latencies.append(elapsed)
+        total += elapsed
+
+    return {
+        "name": name,
+        "phase": phase,
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ops_per_s": iterations / total if total > 0 else 0.0,
+        "requests": requests,
+        "requests_per_op": sum(requests.values()) / iterations,
+    }
+
+
+async def run(args) -> List[dict]:
+    fake_wiki = FakeWiki(args.categories, args.category_size, args.subcats, args.latency_ms / 1000)
+    fake_bingosync = FakeBingoSync(args.latency_ms / 1000)
+    (runners, wiki_url, bingosync_url) = await start_servers(fake_wiki, fake_bingosync)
+
+    use_stand_ins(
+        wiki_url,
+        bingosync_url,
+        db_file=args.db,
+        wiki_rate_limit=args.rate_limit,
+        board_pool_depth=args.board_pool_depth,
+    )
+
+    # Imported only now, so they pick up the overridden settings.
+    import board
+    import db
+    import http_client
+    import main
+    import wiki
+
+    db.migrate_db()
+
+    category_names = [f"Bench {i}" for i in range(args.categories)]
+    preset_entries = category_names + [f"Article {n}" for n in range(5)]
+    servers = [fake_wiki, fake_bingosync]
+    results = []
+
+    async def nothing():
+        pass
+
+    async def cold():
+        reset_caches()
+
+    async def cold_with_preset():
+        reset_caches()
+        await db.create_preset("bench", preset_entries)
+
+    async def recreate_preset():
+        db.delete_preset("bench")
+
+    async def category_contents():
+        await wiki.category_contents(category_names[0])
+
+    async def create_preset():
+        await db.create_preset("bench", preset_entries)
+
+    async def generate_board():
+        await main.generate_board_for_preset("bench")
+
+    async def start_game():
+        await main.start_game(FakeContext(), "TODO", "bench")
+
+    scenarios = [
+        ("wiki.category_contents", cold, nothing, category_contents),
+        ("db.create_preset", cold, recreate_preset, create_preset),
+        ("generate_board_for_preset", cold_with_preset, nothing, generate_board),
+        ("start_game", cold_with_preset, nothing, start_game),
+    ]
+
+    try:
+        for name, cold_setup, warm_setup, operation in scenarios:
+            results.append(
+                await measure(name, "cold", args.iterations, cold_setup, operation, servers)
+            )
+            results.append(
+                await measure(name, "warm", args.iterations, warm_setup, operation, servers)
+            )
+
+            # Let background refills finish so they aren't billed to the next run.
+            while len(board._refills) > 0:
+                await asyncio.sleep(0.01)
+    finally:
+        await http_client.close()
+        await stop_servers(runners)
+
+    return results
+
+
+def print_report(results: List[dict]):
+    print(
+        f"{'benchmark':<28}{'phase':<7}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'ops/s':>10}{'req/op':>9}  requests"
+    )
+
+    for result in results:
+        requests = ", ".join(f"{kind}={count}" for kind, count in result["requests"].items())
+        print(
+            f"{result['name']:<28}{result['phase']:<7}"
+            f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['ops_per_s']:>10.1f}{result['requests_per_op']:>9.1f}  {requests}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bot's hot paths against local Wikipedia and BingoSync stand-ins."
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=4, help="categories in the benchmark preset")
+    parser.add_argument("--category-size", type=int, default=2000, help="pages per category")
+    parser.add_argument("--subcats", type=int, default=2, help="subcategories per category")
+    parser.add_argument("--latency-ms", type=float, default=20, help="simulated server latency")
+    parser.add_argument("--rate-limit", type=float, default=0, help="wiki_rate_limit to run with")
+    parser.add_argument("--board-pool-depth", type=int, default=config.board_pool_depth())
+    parser.add_argument(
+        "--db", help="database to start from; a temporary copy is benchmarked, never the file itself"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db is None:
+            args.db = os.path.join(tmpdir, "bench.db")
+        else:
+            args.db = copy_db(args.db, tmpdir)
+
+        # The code under test is chatty; keep the report readable.
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(args))
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
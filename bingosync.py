@@ -0,0 +1,172 @@
+from html.parser import HTMLParser
+
+import config
+import http_client
+
+
+class BingoSyncError(Exception):
+    pass
+
+
+class _CsrfTokenParser(HTMLParser):
+    # Stops caring about the document as soon as the token input turns up.
+
+    def __init__(self):
+        super().__init__()
+        self.token = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.token is None and tag == "input":
+            attrs = dict(attrs)
+            if attrs.get("name") == "csrfmiddlewaretoken":
+                self.token = attrs.get("value") or None
+
+
+class _AlertParser(HTMLParser):
+    # Collects the text of the first <div class="alert ..."> block.
+
+    def __init__(self):
+        super().__init__()
+        self.depth = 0
+        self.done = False
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done or tag != "div":
+            return
+
+        if self.depth > 0:
+            self.depth += 1
+        elif "alert" in (dict(attrs).get("class") or "").split():
+            self.depth = 1
+
+    def handle_endtag(self, tag):
+        if self.depth > 0 and tag == "div":
+            self.depth -= 1
+            self.done = self.depth == 0
+
+    def handle_data(self, data):
+        if self.depth > 0:
+            self.parts.append(data)
+
+
+def extract_csrf_token(html: str) -> str | None:
+    # The token input sits in the room creation form, so only feed the
+    # document up to the end of that tag instead of parsing the whole page.
+    start = html.find('name="csrfmiddlewaretoken"')
+    if start < 0:
+        return None
+
+    tag_start = html.rfind("<", 0, start)
+    tag_end = html.find(">", start)
+    if tag_start < 0 or tag_end < 0:
+        return None
+
+    parser = _CsrfTokenParser()
+    parser.feed(html[tag_start : tag_end + 1])
+
+    return parser.token
+
+
+def extract_alert(html: str) -> str:
+    parser = _AlertParser()
+    parser.feed(html)
+
+    return " ".join(" ".join(parser.parts).split())
+
+
+class BingoSyncClient:
+    # Long-lived room creator. The bingosync.com session from http_client
+    # keeps the csrftoken cookie, and the matching form token is reused until
+    # a POST is rejected, so creating a room is normally a single POST.
+
+    POST_HEADERS = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Accept": "text/html,application/xhtml+xml,application/xml",
+        "Accept-Language": "en-US,en;q=0.5",
+    }
+
+    def __init__(self, base_url: str = None):
+        self.base_url = base_url or config.bingosync_url()
+        self.csrf_token = None
+
+    async def _fetch_csrf_token(self) -> str:
+        try:
+            resp = await http_client.get(self.base_url)
+        except http_client.HttpError as err:
+            print(f"BingoSyncClient: {err}")
+            raise BingoSyncError("Unable to reach bingosync.com.") from err
+
+        if resp.status != 200:
+            raise BingoSyncError(
+                f"GET request to bingosync.com gave status code {resp.status}"
+            )
+
+        token = extract_csrf_token(resp.text())
+
+        if token is None:
+            raise BingoSyncError("Unable to find CSRF middleware token in response HTML.")
+
+        print(f"Found csrfmiddlewaretoken {token}")
+
+        return token
+
+    async def _post_room(self, post_params) -> http_client.Response:
+        try:
+            return await http_client.post(
+                self.base_url,
+                data={**post_params, "csrfmiddlewaretoken": self.csrf_token},
+                headers=self.POST_HEADERS,
+                allow_redirects=False,
+            )
+        except http_client.HttpError as err:
+            print(f"BingoSyncClient: {err}")
+            raise BingoSyncError("Unable to reach bingosync.com.") from err
+
+    async def create_room(
+        self,
+        custom_json: str,
+        lockout_mode: str = None,
+        variant_type: str = None,
+        seed: str = "",
+    ) -> str:
+        # Returns the room path from the Location header, e.g. "/room/abc123".
+        settings = config.settings()
+
+        post_params = {
+            "room_name": settings.bingosync_room_name,
+            "passphrase": settings.bingosync_passphrase,
+            "nickname": settings.bingosync_nickname,
+            "game_type": "18",  # custom
+            "variant_type": variant_type or settings.bingosync_variant_type,
+            "custom_json": custom_json,
+            "lockout_mode": lockout_mode or settings.bingosync_lockout_mode,
+            "seed": seed,
+            "hide_card": "on",
+        }
+
+        token_was_cached = self.csrf_token is not None
+
+        if not token_was_cached:
+            self.csrf_token = await self._fetch_csrf_token()
+
+        resp = await self._post_room(post_params)
+
+        # Django answers a stale or mismatched CSRF token with a 403.
+        if resp.status == 403 and token_was_cached:
+            self.csrf_token = await self._fetch_csrf_token()
+            resp = await self._post_room(post_params)
+
+        if "Location" not in resp.headers:
+            if resp.status == 403:
+                self.csrf_token = None
+
+            print(f"POST request status code: {resp.status}")
+            print(f"POST request headers: {resp.headers}")
+            print(f"Alert block text: {extract_alert(resp.text())}")
+
+            raise BingoSyncError(
+                f"Got unexpected status code from POST request {resp.status} with no Location header"
+            )
+
+        return resp.headers["Location"]
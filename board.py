@@ -0,0 +1,226 @@
+import asyncio
+import random
+
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from itertools import accumulate
+from json import dumps
+from typing import Dict, List, Tuple
+
+import config
+import db
+import wiki
+
+BOARD_SIZE = 25
+
+
+class _Pool:
+    # The pages one preset entry can contribute: a single article, or every
+    # cached category in a category's tree. Pages are addressed by position,
+    # so drawing one only has to read that single page id from the cache.
+
+    def __init__(self, weight: float, sources: List[Tuple[str, str | int, int]]):
+        # sources are (entry_type, category name or article page id, page_count)
+        self.weight = weight
+        self.sources = sources
+        self.offsets = list(accumulate(count for (_, _, count) in sources))
+        self.total = self.offsets[-1] if len(self.offsets) > 0 else 0
+        self.drawn = set()
+
+    def exhausted(self) -> bool:
+        return len(self.drawn) >= self.total
+
+    def draw(self) -> int | None:
+        # Uniform over the positions not drawn yet, so a category contributes
+        # in proportion to its size within this entry.
+        position = random.randrange(self.total)
+        while position in self.drawn:
+            position = random.randrange(self.total)
+
+        self.drawn.add(position)
+
+        source_index = bisect_right(self.offsets, position)
+        (entry_type, name, _) = self.sources[source_index]
+        index = position - (self.offsets[source_index - 1] if source_index > 0 else 0)
+
+        if entry_type == db.EntryType.ARTICLE.value:
+            return name
+
+        return db.category_page_id_at(name, index)
+
+
+async def _pools_for_preset(preset_name: str, cat_depth: int) -> List[_Pool]:
+    pools = []
+    entries = db.preset_contents(preset_name)
+
+    articles = [
+        entry["entry_name"]
+        for entry in entries
+        if entry["entry_type"] == db.EntryType.ARTICLE.value
+    ]
+    # Interned when the preset was written, so this is only a read.
+    article_ids = db.page_ids(articles)
+
+    for entry in entries:
+        if entry["weight"] <= 0:
+            continue
+
+        if entry["entry_type"] == db.EntryType.ARTICLE.value:
+            page_id = article_ids.get(entry["entry_name"])
+            sources = [(entry["entry_type"], page_id, 1)] if page_id is not None else []
+        else:
+            sources = [
+                (entry["entry_type"], name, db.category_usable_count(name))
+                for name in await wiki.crawl_category_tree(entry["entry_name"], cat_depth)
+            ]
+
+        pool = _Pool(entry["weight"], [src for src in sources if src[2] > 0])
+
+        if pool.total > 0:
+            pools.append(pool)
+
+    return pools
+
+
+async def sample_board(
+    preset_name: str, cat_depth: int = None, size: int = BOARD_SIZE
+) -> List[str]:
+    # Picks which entry fills each square by weight, then a page within it.
+    # Duplicates across entries are skipped; if the preset runs out of pages
+    # the board simply comes back short.
+    if cat_depth is None:
+        cat_depth = config.category_depth()
+
+    pools = await _pools_for_preset(preset_name, cat_depth)
+
+    # The draws are plain SQLite reads, so run them on a worker thread (with
+    # its own connection) rather than on the event loop.
+    return await asyncio.to_thread(_draw, pools, size)
+
+
+def _draw(pools: List[_Pool], size: int) -> List[str]:
+    # Works on page ids throughout; only the winners are turned into titles.
+    chosen = {}
+
+    while len(chosen) < size and len(pools) > 0:
+        pool = random.choices(pools, weights=[pool.weight for pool in pools])[0]
+        page_id = pool.draw()
+
+        if pool.exhausted():
+            pools.remove(pool)
+
+        if page_id is not None:
+            chosen[page_id] = None
+
+    return db.page_titles(list(chosen))
+
+
+def board_json(squares: List[str]) -> str:
+    # The custom_json format BingoSync expects for a custom board.
+    return dumps([{"name": name} for name in squares])
+
+
+# Ready-to-post boards for recently used presets, most recent last. Each pool
+# carries a generation number so boards built before an invalidation are
+# thrown away instead of landing in the new pool.
+_pools: "OrderedDict[str, deque]" = OrderedDict()
+_generations: Dict[str, int] = {}
+_refills: Dict[str, asyncio.Task] = {}
+_refill_limiter = None
+
+
+def apply_settings():
+    # Called after config.json is reloaded. Refills already waiting keep the
+    # old limiter; new ones use one sized from the new settings.
+    global _refill_limiter
+
+    _refill_limiter = None
+
+
+def _limiter() -> asyncio.Semaphore:
+    global _refill_limiter
+
+    if _refill_limiter is None:
+        _refill_limiter = asyncio.Semaphore(config.board_pool_refill_concurrency())
+
+    return _refill_limiter
+
+
+def _touch(preset_name: str) -> deque:
+    if preset_name not in _pools:
+        _pools[preset_name] = deque()
+
+    _pools.move_to_end(preset_name)
+
+    while len(_pools) > config.board_pool_presets():
+        (old_name, _) = _pools.popitem(last=False)
+        _generations[old_name] = _generations.get(old_name, 0) + 1
+
+    return _pools[preset_name]
+
+
+async def _refill(preset_name: str, generation: int):
+    while (
+        preset_name in _pools
+        and _generations.get(preset_name, 0) == generation
+        and len(_pools[preset_name]) < config.board_pool_depth()
+    ):
+        async with _limiter():
+            squares = await sample_board(preset_name)
+
+        if len(squares) < BOARD_SIZE:
+            # Not enough pages for a board, nothing to pre-generate.
+            return
+
+        if preset_name in _pools and _generations.get(preset_name, 0) == generation:
+            _pools[preset_name].append(board_json(squares))
+
+
+def schedule_refill(preset_name: str):
+    if config.board_pool_depth() <= 0 or preset_name in _refills:
+        return
+
+    task = asyncio.create_task(_refill(preset_name, _generations.get(preset_name, 0)))
+    task.add_done_callback(lambda done: _refill_done(preset_name, done))
+    _refills[preset_name] = task
+
+
+def _refill_done(preset_name: str, task: asyncio.Task):
+    # An invalidated refill may finish after its replacement was scheduled.
+    if _refills.get(preset_name) is task:
+        del _refills[preset_name]
+
+
+async def take_board(preset_name: str) -> str | None:
+    # Pops a pre-generated board if there is one, otherwise builds one inline.
+    # Either way the pool is topped back up in the background. Returns None
+    # when the preset doesn't exist or doesn't have enough pages for a full
+    # board. Unknown names never take a slot in the pool.
+    if not db.preset_exists(preset_name):
+        return None
+
+    pool = _touch(preset_name)
+    board = pool.popleft() if len(pool) > 0 else None
+
+    if board is None:
+        squares = await sample_board(preset_name)
+        board = board_json(squares) if len(squares) >= BOARD_SIZE else None
+
+    if board is not None:
+        schedule_refill(preset_name)
+
+    return board
+
+
+def invalidate_pool(preset_name: str):
+    # Called whenever a preset's entries change.
+    _generations[preset_name] = _generations.get(preset_name, 0) + 1
+
+    if preset_name in _pools:
+        _pools[preset_name].clear()
+        _refills.pop(preset_name, None)
+        schedule_refill(preset_name)
+
+
+def pool_stats() -> Dict[str, int]:
+    return {name: len(pool) for name, pool in _pools.items()}
@@ -1,20 +1,366 @@
 import json
+import os
+
+from dataclasses import dataclass, fields, replace
+from typing import List
 
 _CONFIG_PATH = "config.json"
 
 
+@dataclass(frozen=True)
+class Settings:
+    # Everything in config.json besides the credentials is optional.
+    client_token: str = ""
+    notify_channel: int = 0
+    permissions: int = 0
+
+    db_file: str = "wiki.db"
+    db_busy_timeout: float = 10.0
+
+    # HTTP
+    wiki_api_url: str = "https://en.wikipedia.org/w/api.php"
+    bingosync_url: str = "https://bingosync.com/"
+    http_timeout: float = 15.0
+    http_connect_timeout: float = 5.0
+    http_max_concurrency: int = 8
+    http_pool_size: int = 4
+
+    # Wikipedia API throttle in requests per second (0 = unthrottled)
+    wiki_rate_limit: float = 5.0
+    wiki_rate_burst: int = 10
+
+    # Category cache: TTL in seconds, refresh interval in minutes
+    category_cache_ttl: int = 7 * 24 * 60 * 60
+    cache_refresh_interval: float = 30
+    cache_refresh_batch: int = 20
+
+    # Refreshes only fetch members added since the last sync; a full re-fetch
+    # happens when the member counts disagree, or after this many seconds
+    category_full_sync_interval: int = 30 * 24 * 60 * 60
+
+    # Seconds before a category whose refresh failed is tried again on access
+    category_refresh_cooldown: int = 5 * 60
+
+    # Seconds to remember that a name isn't a Wikipedia article or category
+    negative_cache_ttl: int = 60 * 60
+
+    # Subcategory crawling, and the cap on pages cached per category (0 = none)
+    category_depth: int = 1
+    crawl_concurrency: int = 4
+    crawl_max_pages: int = 5000
+    category_max_members: int = 0
+
+    # In-memory LRU sizes, category_cache_bytes = 0 for no byte limit
+    preset_cache_entries: int = 256
+    category_cache_entries: int = 512
+    category_cache_bytes: int = 64 * 1024 * 1024
+
+    # Pre-generated board pool, board_pool_depth = 0 to disable it
+    board_pool_depth: int = 3
+    board_pool_presets: int = 8
+    board_pool_refill_concurrency: int = 2
+
+    # Background cache warming: how many of the most-used presets to warm at
+    # startup, and how many categories the warmer fetches at once
+    warm_presets_on_start: int = 5
+    warm_concurrency: int = 2
+
+    # Game creation queue: concurrent games being created, and how many more
+    # may wait before new requests are turned away
+    game_workers: int = 2
+    game_queue_depth: int = 20
+
+    # BingoSync room settings
+    bingosync_room_name: str = "discord bot test"
+    bingosync_passphrase: str = "youllneverguess"
+    bingosync_nickname: str = "wikibot"
+    bingosync_lockout_mode: str = "2"
+    bingosync_variant_type: str = "172"  # randomized
+
+    # Prometheus export: a text file rewritten every metrics_interval seconds
+    # and/or a /metrics endpoint on localhost (empty / 0 = off)
+    metrics_file: str = ""
+    metrics_port: int = 0
+    metrics_interval: float = 15
+
+    # Commands slower than profile_threshold seconds are kept (the last
+    # slow_command_history of them) with per-phase timings; with
+    # profile_commands on, a cProfile capture is written to profile_dir too
+    profile_commands: bool = False
+    profile_threshold: float = 2.0
+    profile_dir: str = "profiles"
+    slow_command_history: int = 20
+
+    # Seconds between checks of config.json's mtime
+    config_poll_interval: float = 30
+
+
+# Settings only read when something is first set up (the database
+# connection, HTTP sessions, the BingoSync client, the metrics server). The
+# rest take effect on reload, some through each module's apply_settings().
+RESTART_REQUIRED = frozenset(
+    {
+        "client_token",
+        "db_file",
+        "db_busy_timeout",
+        "bingosync_url",
+        "http_timeout",
+        "http_connect_timeout",
+        "http_max_concurrency",
+        "http_pool_size",
+        "metrics_port",
+    }
+)
+
+_settings = Settings()
+_raw = {}
+_mtime = None
+
+_TRUE = {"true", "yes", "on", "1"}
+_FALSE = {"false", "no", "off", "0"}
+
+
+def _convert(field_type, value):
+    # bool("false") is True, so booleans are checked explicitly.
+    if field_type is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+            return value.strip().lower() in _TRUE
+
+        raise ValueError(f"expected true or false, got {value!r}")
+
+    return field_type(value)
+
+
+def _parse(raw: dict) -> Settings:
+    values = {}
+
+    for field in fields(Settings):
+        if field.name in raw:
+            try:
+                values[field.name] = _convert(field.type, raw[field.name])
+            except (ValueError, TypeError) as err:
+                raise ValueError(f"{field.name}: {err}") from err
+
+    return replace(Settings(), **values)
+
+
+def changed_fields(old: Settings, new: Settings) -> List[str]:
+    return [
+        field.name
+        for field in fields(Settings)
+        if getattr(old, field.name) != getattr(new, field.name)
+    ]
+
+
+def reload(force: bool = False) -> List[str]:
+    # Re-reads config.json if its mtime changed (or if forced). A missing or
+    # broken file keeps the current settings. Returns the names of the
+    # settings that changed, if any.
+    global _settings, _raw, _mtime
+
+    try:
+        mtime = os.stat(_CONFIG_PATH).st_mtime_ns
+    except OSError:
+        return []
+
+    if mtime == _mtime and not force:
+        return []
+
+    try:
+        with open(_CONFIG_PATH, "r") as infile:
+            raw = json.loads(infile.read())
+
+        new_settings = _parse(raw)
+    except (OSError, ValueError, TypeError) as err:
+        print(f"Unable to load {_CONFIG_PATH}: {err}")
+        return []
+
+    _mtime = mtime
+    _raw = raw
+    changed = changed_fields(_settings, new_settings)
+    _settings = new_settings
+
+    return changed
+
+
+def settings() -> Settings:
+    return _settings
+
+
 def as_dict():
-    with open(_CONFIG_PATH, "r") as infile:
-        return json.loads(infile.read())
+    return dict(_raw)
+
+
+def override(**values):
+    # Replaces individual settings in memory, e.g. to point bench.py at its
+    # local stand-in servers. Lasts until config.json next changes.
+    global _settings
+
+    _settings = replace(_settings, **values)
 
 
 def notify_channel():
-    return int(as_dict()["notify_channel"])
+    return _settings.notify_channel
 
 
 def token():
-    return as_dict()["client_token"]
+    return _settings.client_token
 
 
 def permissions():
-    return int(as_dict()["permissions"])
+    return _settings.permissions
+
+
+def db_file():
+    return _settings.db_file
+
+
+def db_busy_timeout():
+    return _settings.db_busy_timeout
+
+
+def wiki_api_url():
+    return _settings.wiki_api_url
+
+
+def bingosync_url():
+    return _settings.bingosync_url
+
+
+def http_timeout():
+    return _settings.http_timeout
+
+
+def http_connect_timeout():
+    return _settings.http_connect_timeout
+
+
+def http_max_concurrency():
+    return _settings.http_max_concurrency
+
+
+def http_pool_size():
+    return _settings.http_pool_size
+
+
+def wiki_rate_limit():
+    return _settings.wiki_rate_limit
+
+
+def wiki_rate_burst():
+    return _settings.wiki_rate_burst
+
+
+def category_cache_ttl():
+    return _settings.category_cache_ttl
+
+
+def cache_refresh_interval():
+    return _settings.cache_refresh_interval
+
+
+def cache_refresh_batch():
+    return _settings.cache_refresh_batch
+
+
+def category_full_sync_interval():
+    return _settings.category_full_sync_interval
+
+
+def category_refresh_cooldown():
+    return _settings.category_refresh_cooldown
+
+
+def negative_cache_ttl():
+    return _settings.negative_cache_ttl
+
+
+def category_depth():
+    return _settings.category_depth
+
+
+def crawl_concurrency():
+    return _settings.crawl_concurrency
+
+
+def crawl_max_pages():
+    return _settings.crawl_max_pages
+
+
+def category_max_members():
+    return _settings.category_max_members
+
+
+def preset_cache_entries():
+    return _settings.preset_cache_entries
+
+
+def category_cache_entries():
+    return _settings.category_cache_entries
+
+
+def category_cache_bytes():
+    return _settings.category_cache_bytes
+
+
+def board_pool_depth():
+    return _settings.board_pool_depth
+
+
+def board_pool_presets():
+    return _settings.board_pool_presets
+
+
+def board_pool_refill_concurrency():
+    return _settings.board_pool_refill_concurrency
+
+
+def warm_presets_on_start():
+    return _settings.warm_presets_on_start
+
+
+def warm_concurrency():
+    return _settings.warm_concurrency
+
+
+def game_workers():
+    return _settings.game_workers
+
+
+def game_queue_depth():
+    return _settings.game_queue_depth
+
+
+def metrics_file():
+    return _settings.metrics_file
+
+
+def metrics_port():
+    return _settings.metrics_port
+
+
+def metrics_interval():
+    return _settings.metrics_interval
+
+
+def profile_commands():
+    return _settings.profile_commands
+
+
+def profile_threshold():
+    return _settings.profile_threshold
+
+
+def profile_dir():
+    return _settings.profile_dir
+
+
+def slow_command_history():
+    return _settings.slow_command_history
+
+
+reload()
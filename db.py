@@ -8,12 +8,152 @@ from sys import _getframe as frame
 
 from typing import List, Dict, Tuple
 
+from array import array
+from itertools import count
+
+import re
+import sys
+import threading
+import time
 import urllib
+import config
+import lru
+import metrics
+import profiling
 import wiki
 
-DB_FILE = "wiki.db"
+DB_FILE = config.db_file()
+
+# Older SQLite builds cap a statement at 999 bound parameters.
+MAX_SQL_PARAMS = 900
+
+# SQLite connections can't be shared across threads, so each thread that
+# touches the database (the event loop, executor workers) gets its own. WAL
+# mode lets those readers carry on while another connection is writing.
+_local = threading.local()
+
+
+_TABLE_NAME = re.compile(
+    r"\b(?:FROM|INTO|TABLE|INDEX)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I
+)
+_query_types: Dict[str, str] = {}
+
+
+def _query_type(statement: str) -> str:
+    # "SELECT CategoryCache" etc, worked out once per distinct statement.
+    query_type = _query_types.get(statement)
+
+    if query_type is None:
+        words = statement.split(None, 2)
+        verb = words[0].upper() if len(words) > 0 else ""
+
+        if verb == "UPDATE" and len(words) > 1:
+            table = words[1]
+        else:
+            match = _TABLE_NAME.search(statement)
+            table = match.group(1) if match else ""
+
+        query_type = f"{verb} {table}".strip()
+
+        if len(_query_types) < 1000:
+            _query_types[statement] = query_type
+
+    return query_type
+
+
+metrics.describe("sqlite_query_seconds", "SQLite statement latency; includes reading the rows for fetch_all().")
+metrics.describe("sqlite_errors_total", "SQLite statements that failed.")
+
+
+class _TimedConnection(sql.Connection):
+    # Records each statement's latency, and failures, by query type. Rows
+    # read by iterating a cursor aren't timed, to keep the per-row cost at
+    # plain sqlite3's; reads big enough for that to matter use fetch_all(),
+    # which times the statement and reading all of its rows as one.
+
+    def _record(self, statement, started: float):
+        elapsed = time.perf_counter() - started
+        metrics.observe("sqlite_query_seconds", elapsed, query=_query_type(statement))
+        profiling.add_phase_time("db", elapsed)
+
+    def execute(self, statement, parameters=()):
+        started = time.perf_counter()
+
+        try:
+            return super().execute(statement, parameters)
+        except sql.Error:
+            metrics.inc("sqlite_errors_total", query=_query_type(statement))
+            raise
+        finally:
+            self._record(statement, started)
+
+    def executemany(self, statement, parameters):
+        started = time.perf_counter()
+
+        try:
+            return super().executemany(statement, parameters)
+        except sql.Error:
+            metrics.inc("sqlite_errors_total", query=_query_type(statement))
+            raise
+        finally:
+            self._record(statement, started)
+
+    def fetch_all(self, statement, parameters=()) -> list:
+        started = time.perf_counter()
+
+        try:
+            return super().execute(statement, parameters).fetchall()
+        except sql.Error:
+            metrics.inc("sqlite_errors_total", query=_query_type(statement))
+            raise
+        finally:
+            self._record(statement, started)
+
+
+def connection() -> sql.Connection:
+    conn = getattr(_local, "conn", None)
+
+    if conn is None:
+        conn = sql.connect(
+            DB_FILE,
+            timeout=config.db_busy_timeout(),
+            cached_statements=256,
+            factory=_TimedConnection,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+
+    return conn
 
-conn = sql.connect(DB_FILE)
+
+def close_connection():
+    # Closes the calling thread's connection, if it has one.
+    conn = getattr(_local, "conn", None)
+
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# In-process read caches, invalidated by the write paths below.
+_preset_cache = lru.LRUCache(max_entries=config.preset_cache_entries())
+_category_cache = lru.LRUCache(
+    max_entries=config.category_cache_entries(),
+    max_bytes=config.category_cache_bytes(),
+)
+
+
+def apply_settings():
+    # Called after config.json is reloaded. db_file needs a restart.
+    _preset_cache.resize(config.preset_cache_entries())
+    _category_cache.resize(config.category_cache_entries(), config.category_cache_bytes())
+
+
+# Pages.flags bits: pages that make bad bingo squares and are left out of
+# boards.
+PAGE_REDIRECT = 1
+PAGE_DISAMBIGUATION = 2
+PAGE_LIST = 4
 
 
 class EntryType(Enum):
@@ -30,7 +170,7 @@ def urlFormat(s):
 def create_entry(entry_name: str, entry_type: EntryType) -> bool:
     funcname = frame().f_code.co_name
 
-    global conn
+    conn = connection()
     res = True
 
     with conn:
@@ -47,25 +187,27 @@ def create_entry(entry_name: str, entry_type: EntryType) -> bool:
     return res
 
 
-def create_entries_from_names(name_list: List[str]) -> Tuple[bool, str]:
-    # Ensure that all names are either articles or categories.
-    entry_list = [
-        {"entry_name": name, "entry_type": wiki.entry_type(name)} for name in name_list
-    ]
+async def create_entries_from_names(
+    name_list: List[str],
+) -> Tuple[bool, str, Dict[str, str]]:
+    # Ensure that all names are either articles or categories. Entries are
+    # created under the titles the names resolve to (after normalization and
+    # redirects), and {name: resolved title} is returned.
+    resolved = await wiki.resolve_entries(name_list)
 
-    invalid_names = [
-        ent["entry_name"] for ent in entry_list if ent["entry_type"] == "err"
-    ]
+    invalid_names = [name for name in name_list if resolved[name][0] == "err"]
 
     if len(invalid_names) > 0:
         return (
             False,
             f"The following entries were not found as articles/categories: {', '.join(invalid_names)}",
+            {},
         )
 
-    create_entries(entry_list)
+    targets = {name: target or name for name, (_, target) in resolved.items()}
+    create_entries([(targets[name], entry_type) for name, (entry_type, _) in resolved.items()])
 
-    return (True, "")
+    return (True, "", targets)
 
 
 def create_entries(
@@ -80,7 +222,54 @@ def create_entries(
         return []
 
 
-def create_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
+def known_entries(entry_names: List[str]) -> set:
+    # Looks up only the submitted names through the entry_name primary key,
+    # in chunks that stay under SQLite's bound-parameter limit.
+    conn = connection()
+
+    names = list(dict.fromkeys(entry_names))
+    known = set()
+
+    with conn:
+        for i in range(0, len(names), MAX_SQL_PARAMS):
+            chunk = names[i : i + MAX_SQL_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+
+            known.update(
+                row[0]
+                for row in conn.execute(
+                    f"SELECT entry_name FROM PresetEntries WHERE entry_name IN ({placeholders})",
+                    chunk,
+                )
+            )
+
+    return known
+
+
+async def _resolve_preset_entries(entries: List[str]) -> Tuple[bool, str, List[str]]:
+    # The entry list with names not already stored replaced by the titles
+    # they resolve to, so a redirect or a differently-cased name ends up as
+    # the same entry (and the same cached category) as the real title.
+    known = known_entries(entries)
+    not_found_entries = [entry for entry in entries if entry not in known]
+    targets = {}
+
+    if len(not_found_entries) > 0:
+        (success, reason, targets) = await create_entries_from_names(not_found_entries)
+        if not success:
+            return (success, reason, [])
+
+    return (True, "", list(dict.fromkeys(targets.get(entry, entry) for entry in entries)))
+
+
+def _stored_names(entries: List[str]) -> List[str]:
+    # Maps names as typed onto the resolved titles presets store.
+    targets = entry_targets(entries)
+
+    return [targets.get(entry, entry) for entry in entries]
+
+
+async def create_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
     funcname = frame().f_code.co_name
 
     if len(entries) == 0:
@@ -91,32 +280,25 @@ def create_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
         print(f"{funcname}: preset {preset_name} already exists")
         return (False, "A preset by the same name already exists.")
 
-    global conn
+    conn = connection()
 
-    with conn:
-        all_valid_entries = set(
-            list(conn.execute("SELECT entry_name FROM PresetEntries"))[0]
-        )
-
-    not_found_entries = [entry for entry in entries if entry not in all_valid_entries]
-
-    if len(not_found_entries) > 0:
-        (success, reason) = create_entries_from_names(not_found_entries)
-        if not success:
-            return (success, reason)
-
-    entries_json = dumps(entries)
+    (success, reason, entries) = await _resolve_preset_entries(entries)
+    if not success:
+        return (success, reason)
 
     with conn:
         conn.execute(
-            "INSERT OR IGNORE INTO Presets(preset_name, entries) VALUES(?, ?)",
-            (preset_name, entries_json),
+            "INSERT OR IGNORE INTO Presets(preset_name) VALUES(?)", (preset_name,)
         )
+        _insert_memberships(preset_name, entries)
+        _intern_preset_articles(conn, entries)
+
+    _preset_cache.invalidate(preset_name)
 
     return (True, "")
 
 
-def update_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
+async def update_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
     funcname = frame().f_code.co_name
 
     if len(entries) == 0:
@@ -127,32 +309,25 @@ def update_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
         print(f"{funcname}: preset {preset_name} doesn't exist")
         return (False, f'No preset found with the name "{preset_name}".')
 
-    global conn
+    conn = connection()
 
-    with conn:
-        all_valid_entries = set(
-            list(conn.execute("SELECT entry_name FROM PresetEntries"))[0]
-        )
-
-    not_found_entries = [entry for entry in entries if entry not in all_valid_entries]
-
-    if len(not_found_entries) > 0:
-        (success, reason) = create_entries_from_names(not_found_entries)
-        if not success:
-            return (success, reason)
-
-    entries_json = dumps(entries)
+    (success, reason, entries) = await _resolve_preset_entries(entries)
+    if not success:
+        return (success, reason)
 
     with conn:
         conn.execute(
-            "UPDATE Presets SET entries = ? WHERE preset_name = ?",
-            (entries_json, preset_name),
+            "DELETE FROM PresetMembership WHERE preset_name = ?", (preset_name,)
         )
+        _insert_memberships(preset_name, entries)
+        _intern_preset_articles(conn, entries)
+
+    _preset_cache.invalidate(preset_name)
 
     return (True, "")
 
 
-def append_to_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
+async def append_to_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
     funcname = frame().f_code.co_name
 
     if len(entries) == 0:
@@ -163,41 +338,17 @@ def append_to_preset(preset_name: str, entries: List[str]) -> Tuple[bool, str]:
         print(f"{funcname}: preset {preset_name} doesn't exist")
         return (False, f'No preset found with the name "{preset_name}".')
 
-    global conn
+    conn = connection()
 
-    with conn:
-        all_valid_entries = set(
-            list(conn.execute("SELECT entry_name FROM PresetEntries"))[0]
-        )
-
-    not_found_entries = [entry for entry in entries if entry not in all_valid_entries]
-
-    if len(not_found_entries) > 0:
-        (success, reason) = create_entries_from_names(not_found_entries)
-        if not success:
-            return (success, reason)
+    (success, reason, entries) = await _resolve_preset_entries(entries)
+    if not success:
+        return (success, reason)
 
     with conn:
-        existing_entries = set(
-            loads(
-                list(
-                    conn.execute(
-                        "SELECT entries FROM Presets WHERE preset_name = ?",
-                        (preset_name,),
-                    )
-                )[0][0]
-            )
-        )
+        _insert_memberships(preset_name, entries)
+        _intern_preset_articles(conn, entries)
 
-    merged_entries = existing_entries.union(set(entries))
-
-    entries_json = dumps(list(merged_entries))
-
-    with conn:
-        conn.execute(
-            "UPDATE Presets SET entries = ? WHERE preset_name = ?",
-            (entries_json, preset_name),
-        )
+    _preset_cache.invalidate(preset_name)
 
     return (True, "")
 
@@ -209,12 +360,15 @@ def delete_preset(preset_name: str) -> Tuple[bool, str]:
         print(f"{funcname}: preset {preset_name} doesn't exist")
         return (False, f'No preset found with the name "{preset_name}".')
 
-    global conn
+    conn = connection()
 
     with conn:
         conn.execute(
-            "DELETE FROM Presets WHERE preset_name = ? LIMIT 1", (preset_name,)
+            "DELETE FROM PresetMembership WHERE preset_name = ?", (preset_name,)
         )
+        conn.execute("DELETE FROM Presets WHERE preset_name = ?", (preset_name,))
+
+    _preset_cache.invalidate(preset_name)
 
     return (True, "")
 
@@ -230,66 +384,126 @@ def remove_from_preset(preset_name: str, entries: List[str]) -> bool:
         print(f"{funcname}: preset {preset_name} doesn't exist")
         return (False, f'No preset found with the name "{preset_name}".')
 
-    global conn
+    conn = connection()
+    names = set(entries + _stored_names(entries))
 
     with conn:
-        existing_entries = set(
-            loads(
-                list(
-                    conn.execute(
-                        "SELECT entries FROM Presets WHERE preset_name = ?",
-                        (preset_name,),
-                    )
-                )[0][0]
-            )
+        conn.executemany(
+            "DELETE FROM PresetMembership WHERE preset_name = ? AND entry_name = ?",
+            [(preset_name, entry) for entry in names],
         )
 
-    merged_entries = existing_entries.difference(set(entries))
+    _preset_cache.invalidate(preset_name)
+
+    return (True, "")
+
+
+def set_entry_weight(
+    preset_name: str, entry_name: str, weight: float
+) -> Tuple[bool, str]:
+    funcname = frame().f_code.co_name
+
+    if weight < 0:
+        print(f"{funcname}: negative weight {weight}")
+        return (False, "Weights can't be negative.")
 
-    entries_json = dumps(list(merged_entries))
+    conn = connection()
+    stored_name = _stored_names([entry_name])[0]
 
     with conn:
-        conn.execute(
-            "UPDATE Presets SET entries = ? WHERE preset_name = ?",
-            (entries_json, preset_name),
-        )
+        updated = conn.execute(
+            "UPDATE PresetMembership SET weight = ? "
+            "WHERE preset_name = ? AND entry_name IN (?, ?)",
+            (weight, preset_name, entry_name, stored_name),
+        ).rowcount
+
+    if updated == 0:
+        print(f"{funcname}: {entry_name} is not in preset {preset_name}")
+        return (False, f'"{entry_name}" is not part of the preset "{preset_name}".')
+
+    _preset_cache.invalidate(preset_name)
 
     return (True, "")
 
 
 def preset_contents(preset_name: str) -> List[Dict[str, str]]:
-    global conn
+    contents = _preset_cache.get(preset_name)
+
+    if contents is None:
+        contents = _load_preset_contents(preset_name)
+        _preset_cache.put(preset_name, contents)
+
+    return contents
+
 
-    entries_joined = []
+def _load_preset_contents(preset_name: str) -> List[Dict[str, str]]:
+    conn = connection()
 
     with conn:
-        entries = loads(
-            list(
-                conn.execute(
-                    "SELECT entries FROM Presets WHERE preset_name = ?", (preset_name,)
-                )
-            )[0][0]
+        rows = conn.fetch_all(
+            "SELECT m.entry_name, e.entry_type, m.weight FROM PresetMembership m "
+            "JOIN PresetEntries e ON e.entry_name = m.entry_name "
+            "WHERE m.preset_name = ? "
+            "ORDER BY m.rowid",
+            (preset_name,),
         )
 
-        for entry_name in entries:
-            entry_type = list(
-                conn.execute(
-                    "SELECT entry_type FROM PresetEntries WHERE entry_name = ?",
-                    (entry_name,),
-                )
-            )[0][0]
-            entries_joined.append({"entry_name": entry_name, "entry_type": entry_type})
+        return [
+            {"entry_name": entry_name, "entry_type": entry_type, "weight": weight}
+            for entry_name, entry_type, weight in rows
+        ]
 
-    return entries_joined
+
+def _insert_memberships(preset_name: str, entries: List[str]):
+    # Callers hold the connection's transaction.
+    conn = connection()
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO PresetMembership(preset_name, entry_name) VALUES(?, ?)",
+        [(preset_name, entry) for entry in entries],
+    )
 
 
 def presets() -> List[Tuple[str, str]]:
-    global conn
+    conn = connection()
 
     with conn:
         return list(conn.execute("SELECT preset_name, description FROM Presets"))
 
 
+def record_preset_use(preset_name: str):
+    conn = connection()
+
+    with conn:
+        conn.execute(
+            "UPDATE Presets SET use_count = use_count + 1, last_used = ? "
+            "WHERE preset_name = ?",
+            (time.time(), preset_name),
+        )
+
+
+def most_used_presets(limit: int) -> List[str]:
+    conn = connection()
+
+    with conn:
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT preset_name FROM Presets WHERE use_count > 0 "
+                "ORDER BY use_count DESC, last_used DESC LIMIT ?",
+                (limit,),
+            )
+        ]
+
+
+def preset_categories(preset_name: str) -> List[str]:
+    return [
+        entry["entry_name"]
+        for entry in preset_contents(preset_name)
+        if entry["entry_type"] == EntryType.CATEGORY.value
+    ]
+
+
 def initialize_test_db():
     db_path = Path(DB_FILE)
 
@@ -298,27 +512,11 @@ def initialize_test_db():
 
     del db_path
 
-    global conn
+    migrate_db()
 
-    with conn:
-        # Create the Presets table if it doesn't exist already
-        # `contents` is a list of keys into the PresetEntries table
-        conn.execute(
-            "CREATE TABLE IF NOT EXISTS Presets("
-            "preset_name TEXT PRIMARY KEY, "
-            "entries JSON DEFAULT('[]'), "
-            "description TEXT"
-            ")"
-        )
-
-        # Create the PresetEntries table if it doesn't exist already
-        conn.execute(
-            "CREATE TABLE IF NOT EXISTS PresetEntries("
-            "entry_name TEXT PRIMARY_KEY, "
-            "entry_type TEXT CHECK( entry_type in ('category', 'article') )"
-            ")"
-        )
+    conn = connection()
 
+    with conn:
         # Load the PresetEntries table with some data
         preset_entries_data = [
             {"entry_name": "The Game Awards winners", "entry_type": "category"},
@@ -341,48 +539,480 @@ def initialize_test_db():
         presets_data = [
             {
                 "preset_name": "GameAwardsWinners",
-                "entries": dumps(["The Game Awards winners"]),
+                "entries": ["The Game Awards winners"],
                 "description": "Games that have won The Game Awards in the past.",
             },
             {
                 "preset_name": "IndieDarlings",
-                "entries": dumps(["Indie games"]),
+                "entries": ["Indie games"],
                 "description": "All indie games.",
             },
             {
                 "preset_name": "Potpourri",
-                "entries": dumps(
-                    [
-                        "Platform fighters",
-                        "Bullet hell video games",
-                        "Digital deck-building card games",
-                        "The Game Awards winners",
-                        "Indie games",
-                    ]
-                ),
+                "entries": [
+                    "Platform fighters",
+                    "Bullet hell video games",
+                    "Digital deck-building card games",
+                    "The Game Awards winners",
+                    "Indie games",
+                ],
                 "description": "A little bit of everything.",
             },
         ]
 
         conn.executemany(
-            "INSERT OR IGNORE INTO Presets(preset_name, entries, description) "
-            "VALUES(:preset_name, :entries, :description)",
+            "INSERT OR IGNORE INTO Presets(preset_name, description) "
+            "VALUES(:preset_name, :description)",
             presets_data,
         )
 
+        for preset in presets_data:
+            _insert_memberships(preset["preset_name"], preset["entries"])
+            _intern_preset_articles(conn, preset["entries"])
+
+    print("Database initialized with test data.")
+
+
+def _table_names() -> List[str]:
+    conn = connection()
+
+    return [
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    ]
+
+
+def _table_columns(table_name: str) -> List[str]:
+    conn = connection()
+
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+
+
+def migrate_db():
+    # Idempotent schema upgrades for databases created by older versions, in
+    # one transaction so a failure leaves the schema as it was. The explicit
+    # BEGIN is needed because sqlite3 doesn't open one for DDL by itself.
+    conn = connection()
+
+    with conn:
+        conn.execute("BEGIN")
+
+        # Create the Presets table if it doesn't exist already
+        # `entries` is a leftover from before PresetMembership and is kept empty
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS Presets("
+            "preset_name TEXT PRIMARY KEY, "
+            "entries JSON DEFAULT('[]'), "
+            "description TEXT, "
+            "use_count INTEGER NOT NULL DEFAULT 0, "
+            "last_used REAL"
+            ")"
+        )
+
+        preset_columns = _table_columns("Presets")
+
+        if "use_count" not in preset_columns:
+            conn.execute(
+                "ALTER TABLE Presets ADD COLUMN use_count INTEGER NOT NULL DEFAULT 0"
+            )
+
+        if "last_used" not in preset_columns:
+            conn.execute("ALTER TABLE Presets ADD COLUMN last_used REAL")
+
+        # Create the PresetEntries table if it doesn't exist already
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS PresetEntries("
+            "entry_name TEXT PRIMARY KEY, "
+            "entry_type TEXT CHECK( entry_type in ('category', 'article') )"
+            ")"
+        )
+
+        # Older databases declared `PRIMARY_KEY`, which SQLite took as part of
+        # the column type, so entry_name had no key or index. Rebuild the table.
+        entry_pk = [
+            row[5] for row in conn.execute("PRAGMA table_info(PresetEntries)")
+            if row[1] == "entry_name"
+        ]
+
+        if entry_pk != [1]:
+            conn.execute(
+                "CREATE TABLE PresetEntries_new("
+                "entry_name TEXT PRIMARY KEY, "
+                "entry_type TEXT CHECK( entry_type in ('category', 'article') )"
+                ")"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO PresetEntries_new(entry_name, entry_type) "
+                "SELECT entry_name, entry_type FROM PresetEntries"
+            )
+            conn.execute("DROP TABLE PresetEntries")
+            conn.execute("ALTER TABLE PresetEntries_new RENAME TO PresetEntries")
+
+        # Which entries belong to which preset, one row per pair
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS PresetMembership("
+            "preset_name TEXT NOT NULL, "
+            "entry_name TEXT NOT NULL, "
+            "weight REAL NOT NULL DEFAULT 1.0, "
+            "PRIMARY KEY (preset_name, entry_name)"
+            ")"
+        )
+
+        if "weight" not in _table_columns("PresetMembership"):
+            conn.execute(
+                "ALTER TABLE PresetMembership "
+                "ADD COLUMN weight REAL NOT NULL DEFAULT 1.0"
+            )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS PresetMembership_entry_name "
+            "ON PresetMembership(entry_name)"
+        )
+
+        # Move presets still stored as JSON blobs into PresetMembership.
+        json_presets = list(
+            conn.execute(
+                "SELECT preset_name, entries FROM Presets "
+                "WHERE entries IS NOT NULL AND entries != '[]'"
+            )
+        )
+
+        for preset_name, entries in json_presets:
+            _insert_memberships(preset_name, loads(entries))
+            conn.execute(
+                "UPDATE Presets SET entries = '[]' WHERE preset_name = ?",
+                (preset_name,),
+            )
+
         # Create CategoryCache table if not exists
+        # Members are stored as a packed array of Pages ids in `page_ids`;
+        # `pages` is a leftover from when they were a JSON array of titles.
         conn.execute(
             "CREATE TABLE IF NOT EXISTS CategoryCache("
             "category_name TEXT PRIMARY KEY, "
-            "pages JSON DEFAULT('[]')"
+            "pages JSON DEFAULT('[]'), "
+            "subcats JSON DEFAULT('[]'), "
+            "fetched_at REAL, "
+            "ttl INTEGER, "
+            "page_count INTEGER DEFAULT 0, "
+            "page_ids BLOB, "
+            "synced_at TEXT, "
+            "full_synced_at REAL, "
+            "usable_count INTEGER"
             ")"
         )
 
-    print("Database initialized with test data.")
+        # Every page title we've cached, stored once however many categories
+        # it belongs to.
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS Pages("
+            "id INTEGER PRIMARY KEY, "
+            "title TEXT UNIQUE NOT NULL, "
+            "flags INTEGER NOT NULL DEFAULT 0"
+            ")"
+        )
+
+        if "flags" not in _table_columns("Pages"):
+            conn.execute(
+                "ALTER TABLE Pages ADD COLUMN flags INTEGER NOT NULL DEFAULT 0"
+            )
+
+        # Article entries get their Pages ids when a preset is written; give
+        # ones from before that theirs.
+        conn.execute(
+            "INSERT OR IGNORE INTO Pages(title) "
+            "SELECT entry_name FROM PresetEntries WHERE entry_type = 'article'"
+        )
+
+        cache_columns = _table_columns("CategoryCache")
+
+        # Rows from before fetched_at existed are left NULL, which reads as expired.
+        if "fetched_at" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN fetched_at REAL")
+
+        if "ttl" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN ttl INTEGER")
+
+        if "subcats" not in cache_columns:
+            conn.execute(
+                "ALTER TABLE CategoryCache ADD COLUMN subcats JSON DEFAULT('[]')"
+            )
+
+        if "page_count" not in cache_columns:
+            conn.execute(
+                "ALTER TABLE CategoryCache ADD COLUMN page_count INTEGER DEFAULT 0"
+            )
+
+        if "page_ids" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN page_ids BLOB")
+
+        # Incremental sync marks: the newest member timestamp seen (as the API
+        # formats it) and when the list was last fetched in full.
+        if "synced_at" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN synced_at TEXT")
+
+        if "full_synced_at" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN full_synced_at REAL")
+
+        # page_ids holds the usable pages first and the flagged ones after
+        # them. NULL means the pages were cached before they had flags.
+        if "usable_count" not in cache_columns:
+            conn.execute("ALTER TABLE CategoryCache ADD COLUMN usable_count INTEGER")
+
+        # Convert page lists still stored as JSON title arrays.
+        json_rows = list(
+            conn.execute(
+                "SELECT category_name, pages FROM CategoryCache "
+                "WHERE pages IS NOT NULL AND pages != '[]'"
+            )
+        )
+
+        for category_name, pages in json_rows:
+            _store_page_ids(conn, category_name, _intern_titles(conn, loads(pages)))
+
+        # Convert page lists stored one row per title in CategoryMembers.
+        if "CategoryMembers" in _table_names():
+            member_rows = conn.execute(
+                "SELECT c.category_name, m.page_title FROM CategoryCache c "
+                "JOIN CategoryMembers m "
+                "ON m.category_name = c.category_name AND m.fetch_id = c.fetch_id "
+                "ORDER BY c.category_name"
+            ).fetchall()
+
+            by_category = {}
+            for category_name, title in member_rows:
+                by_category.setdefault(category_name, []).append(title)
+
+            for category_name, titles in by_category.items():
+                _store_page_ids(conn, category_name, _intern_titles(conn, titles))
+
+            conn.execute("DROP TABLE CategoryMembers")
+
+        # Results of Wikipedia title lookups, misses included, so retried
+        # commands don't repeat them. `target` is the normalized or redirect
+        # target the name resolved to.
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS EntryLookups("
+            "entry_name TEXT PRIMARY KEY, "
+            "entry_type TEXT NOT NULL, "
+            "target TEXT, "
+            "looked_up_at REAL NOT NULL, "
+            "ttl INTEGER NOT NULL"
+            ")"
+        )
+
+        # Offline category index, filled by wikidump.py from Wikipedia dumps.
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS DumpPages("
+            "page_id INTEGER PRIMARY KEY, "
+            "namespace INTEGER NOT NULL, "
+            "title TEXT NOT NULL, "
+            "is_redirect INTEGER NOT NULL DEFAULT 0"
+            ")"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS DumpPages_title ON DumpPages(namespace, title)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS DumpCategoryLinks("
+            "cl_to TEXT NOT NULL, "
+            "cl_type TEXT NOT NULL, "
+            "cl_from INTEGER NOT NULL, "
+            "PRIMARY KEY (cl_to, cl_type, cl_from)"
+            ") WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS DumpLinkTargets("
+            "lt_id INTEGER PRIMARY KEY, "
+            "title TEXT NOT NULL"
+            ")"
+        )
+
+
+# Offline category index lookups. Everything here answers "don't know" when no
+# dump has been imported, so callers fall back to the API.
+_dump_index_available = None
+
+
+def dump_index_available() -> bool:
+    global _dump_index_available
+
+    if _dump_index_available is None:
+        conn = connection()
+
+        with conn:
+            _dump_index_available = (
+                len(list(conn.execute("SELECT 1 FROM DumpCategoryLinks LIMIT 1"))) > 0
+            )
+
+    return _dump_index_available
+
+
+def dump_index_changed():
+    global _dump_index_available
+
+    _dump_index_available = None
+
+
+def dump_has_category(category_name: str) -> bool:
+    if not dump_index_available():
+        return False
+
+    conn = connection()
+
+    with conn:
+        rows = list(
+            conn.execute(
+                "SELECT 1 FROM DumpCategoryLinks WHERE cl_to = ? LIMIT 1",
+                (category_name,),
+            )
+        )
+
+    return len(rows) > 0
+
+
+def dump_category_subcats(category_name: str) -> List[str]:
+    conn = connection()
+
+    with conn:
+        rows = conn.execute(
+            "SELECT p.title FROM DumpCategoryLinks l "
+            "JOIN DumpPages p ON p.page_id = l.cl_from "
+            "WHERE l.cl_to = ? AND l.cl_type = 'subcat' AND p.namespace = 14",
+            (category_name,),
+        )
+
+        return [row[0] for row in rows]
+
+
+def dump_category_pages(category_name: str, batch_size: int = 500):
+    # Yields the category's articles as (title, is_redirect) in batches of
+    # batch_size.
+    conn = connection()
+
+    cursor = conn.execute(
+        "SELECT p.title, p.is_redirect FROM DumpCategoryLinks l "
+        "JOIN DumpPages p ON p.page_id = l.cl_from "
+        "WHERE l.cl_to = ? AND l.cl_type = 'page' AND p.namespace = 0",
+        (category_name,),
+    )
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+
+            if len(rows) == 0:
+                break
+
+            yield rows
+    finally:
+        cursor.close()
+
+
+def dump_entry_types(entry_names: List[str]) -> Dict[str, str]:
+    # Types for the names the dump knows about; unknown names are left out.
+    if not dump_index_available():
+        return {}
+
+    conn = connection()
+    types = {}
+
+    with conn:
+        for name in entry_names:
+            if dump_has_category(name):
+                types[name] = EntryType.CATEGORY.value
+                continue
+
+            rows = list(
+                conn.execute(
+                    "SELECT 1 FROM DumpPages WHERE namespace = 0 AND title = ? LIMIT 1",
+                    (name,),
+                )
+            )
+
+            if len(rows) > 0:
+                types[name] = EntryType.ARTICLE.value
+
+    return types
+
+
+def cached_entry_lookups(entry_names: List[str]) -> Dict[str, Tuple[str, str | None]]:
+    # {name: (entry type, resolved title)} from earlier API lookups that
+    # haven't expired, including misses ("err", None). Names never looked up
+    # are left out.
+    conn = connection()
+    resolved = {}
+
+    with conn:
+        for i in range(0, len(entry_names), MAX_SQL_PARAMS):
+            chunk = entry_names[i : i + MAX_SQL_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+
+            resolved.update(
+                (entry_name, (entry_type, target))
+                for entry_name, entry_type, target in conn.execute(
+                    "SELECT entry_name, entry_type, target FROM EntryLookups "
+                    f"WHERE entry_name IN ({placeholders}) "
+                    "AND looked_up_at + ttl > ?",
+                    chunk + [time.time()],
+                )
+            )
+
+    return resolved
+
+
+def entry_targets(entry_names: List[str]) -> Dict[str, str]:
+    # What each name was last resolved to, expired or not, for matching names
+    # as typed against the resolved ones stored in presets.
+    conn = connection()
+    targets = {}
+
+    with conn:
+        for i in range(0, len(entry_names), MAX_SQL_PARAMS):
+            chunk = entry_names[i : i + MAX_SQL_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+
+            targets.update(
+                conn.execute(
+                    "SELECT entry_name, target FROM EntryLookups "
+                    f"WHERE entry_name IN ({placeholders}) AND target IS NOT NULL",
+                    chunk,
+                )
+            )
+
+    return targets
+
+
+def record_entry_lookups(lookups: List[Tuple[str, str, str | None]]):
+    # (entry_name, entry_type, resolved title) rows. Misses expire after the
+    # short negative_cache_ttl, resolved names after category_cache_ttl.
+    conn = connection()
+    now = time.time()
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO EntryLookups"
+            "(entry_name, entry_type, target, looked_up_at, ttl) "
+            "VALUES(?, ?, ?, ?, ?)",
+            [
+                (
+                    name,
+                    entry_type,
+                    target,
+                    now,
+                    config.negative_cache_ttl()
+                    if entry_type == EntryType.ERROR.value
+                    else config.category_cache_ttl(),
+                )
+                for (name, entry_type, target) in lookups
+            ],
+        )
 
 
 def category_cache_exists(category_name: str) -> bool:
-    global conn
+    conn = connection()
+
+    if ("ids", category_name) in _category_cache:
+        return True
 
     with conn:
         cache_row = list(
@@ -395,38 +1025,443 @@ def category_cache_exists(category_name: str) -> bool:
     return len(cache_row) > 0
 
 
+def _pack_ids(ids) -> bytes:
+    # Stored little-endian so the database file is portable.
+    packed = array("I", ids)
+    if sys.byteorder == "big":
+        packed.byteswap()
+
+    return packed.tobytes()
+
+
+def _unpack_ids(blob: bytes | None) -> array:
+    ids = array("I")
+
+    if blob:
+        ids.frombytes(blob)
+        if sys.byteorder == "big":
+            ids.byteswap()
+
+    return ids
+
+
+def _store_page_ids(conn, category_name: str, ids):
+    # Callers hold the connection's transaction.
+    conn.execute(
+        "UPDATE CategoryCache SET pages = '[]', page_ids = ?, page_count = ? "
+        "WHERE category_name = ?",
+        (_pack_ids(ids), len(ids), category_name),
+    )
+
+
+def _page_ids(conn, titles: List[str]) -> Dict[str, int]:
+    # {title: Pages id} for the titles that have been interned.
+    ids = {}
+    unique_titles = list(dict.fromkeys(titles))
+
+    for i in range(0, len(unique_titles), MAX_SQL_PARAMS):
+        chunk = unique_titles[i : i + MAX_SQL_PARAMS]
+        placeholders = ", ".join("?" * len(chunk))
+
+        ids.update(
+            (title, page_id)
+            for page_id, title in conn.fetch_all(
+                f"SELECT id, title FROM Pages WHERE title IN ({placeholders})",
+                chunk,
+            )
+        )
+
+    return ids
+
+
+def _intern_titles(conn, titles: List[str], flags: List[int] = None) -> List[int]:
+    # Callers hold the connection's transaction.
+    if flags is None:
+        conn.executemany(
+            "INSERT OR IGNORE INTO Pages(title) VALUES(?)",
+            [(title,) for title in titles],
+        )
+    else:
+        conn.executemany(
+            "INSERT INTO Pages(title, flags) VALUES(?, ?) "
+            "ON CONFLICT(title) DO UPDATE SET flags = excluded.flags",
+            list(zip(titles, flags)),
+        )
+
+    ids = _page_ids(conn, titles)
+
+    return [ids[title] for title in titles]
+
+
+def intern_titles(titles: List[str], flags: List[int] = None) -> List[int]:
+    # Returns the Pages id for each title, adding any we haven't seen. Page
+    # flags are updated when given.
+    conn = connection()
+
+    with conn:
+        return _intern_titles(conn, titles, flags)
+
+
+def page_ids(titles: List[str]) -> Dict[str, int]:
+    # Read-only: {title: Pages id}, leaving out titles never interned.
+    conn = connection()
+
+    with conn:
+        return _page_ids(conn, titles)
+
+
+def _intern_preset_articles(conn, entries: List[str]):
+    # Gives a preset's article entries their Pages ids when it's written, so
+    # generating a board only has to read them. Callers hold the transaction.
+    names = list(dict.fromkeys(entries))
+
+    for i in range(0, len(names), MAX_SQL_PARAMS):
+        chunk = names[i : i + MAX_SQL_PARAMS]
+        placeholders = ", ".join("?" * len(chunk))
+
+        conn.execute(
+            "INSERT OR IGNORE INTO Pages(title) SELECT entry_name FROM PresetEntries "
+            f"WHERE entry_type = 'article' AND entry_name IN ({placeholders})",
+            chunk,
+        )
+
+
+def page_titles(page_ids: List[int]) -> List[str]:
+    # Resolves Pages ids back to titles, in the same order.
+    conn = connection()
+
+    titles = {}
+    unique_ids = list(dict.fromkeys(page_ids))
+
+    with conn:
+        for i in range(0, len(unique_ids), MAX_SQL_PARAMS):
+            chunk = unique_ids[i : i + MAX_SQL_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+
+            titles.update(
+                conn.fetch_all(
+                    f"SELECT id, title FROM Pages WHERE id IN ({placeholders})",
+                    chunk,
+                )
+            )
+
+    return [titles[page_id] for page_id in page_ids if page_id in titles]
+
+
+def category_page_ids(category_name: str) -> array:
+    ids = _category_cache.get(("ids", category_name))
+
+    if ids is None:
+        conn = connection()
+
+        with conn:
+            rows = list(
+                conn.execute(
+                    "SELECT page_ids FROM CategoryCache WHERE category_name = ?",
+                    (category_name,),
+                )
+            )
+
+        ids = _unpack_ids(rows[0][0] if len(rows) > 0 else None)
+        _category_cache.put(("ids", category_name), ids)
+
+    return ids
+
+
 def category_cache(category_name: str) -> List[str]:
-    global conn
+    # The category's usable pages, see category_usable_count.
+    pages = _category_cache.get(("pages", category_name))
+
+    if pages is None:
+        ids = category_page_ids(category_name)
+        pages = page_titles(ids[: category_usable_count(category_name)])
+        _category_cache.put(("pages", category_name), pages)
+
+    return pages
+
+
+def category_cache_subcats(category_name: str) -> List[str]:
+    conn = connection()
+
+    subcats = _category_cache.get(("subcats", category_name))
+
+    if subcats is None:
+        with conn:
+            cache_string = list(
+                conn.execute(
+                    "SELECT subcats FROM CategoryCache WHERE category_name = ?",
+                    (category_name,),
+                )
+            )[0][0]
+
+        subcats = loads(cache_string) if cache_string else []
+        _category_cache.put(("subcats", category_name), subcats)
+
+    return subcats
+
+
+def category_page_count(category_name: str) -> int:
+    conn = connection()
+
+    with conn:
+        rows = list(
+            conn.execute(
+                "SELECT page_count FROM CategoryCache WHERE category_name = ?",
+                (category_name,),
+            )
+        )
+
+    return rows[0][0] or 0 if len(rows) > 0 else 0
+
+
+def category_usable_count(category_name: str) -> int:
+    # How many of the category's pages make good squares. They come first in
+    # its page_ids, so boards only ever index into that prefix.
+    conn = connection()
 
     with conn:
-        cache_string = list(
+        rows = list(
             conn.execute(
-                "SELECT pages FROM CategoryCache WHERE category_name = ?",
+                "SELECT COALESCE(usable_count, page_count) FROM CategoryCache "
+                "WHERE category_name = ?",
                 (category_name,),
             )
-        )[0][0]
+        )
+
+    return rows[0][0] or 0 if len(rows) > 0 else 0
+
+
+def category_page_id_at(category_name: str, index: int) -> int | None:
+    ids = category_page_ids(category_name)
+
+    return ids[index] if 0 <= index < len(ids) else None
 
-        # print(f"Cached string: {cache_string}")
 
-        cache_row = loads(cache_string)
+# Page ids of fetches that are still streaming in, by fetch id. Titles are
+# interned as each batch arrives; only the 4-byte ids are held until the end.
+_pending_fetches: Dict[int, Tuple[array, array]] = {}
+_pending_fetch_ids = count(1)
 
-    return cache_row
 
+def begin_category_fetch(category_name: str) -> int:
+    # Returns the id that this fetch's batches are tagged with.
+    fetch_id = next(_pending_fetch_ids)
+    _pending_fetches[fetch_id] = (array("I"), array("I"))
 
-def cache_category(category_name: str, pages: List[str]) -> bool:
-    global conn
+    return fetch_id
 
+
+def cache_category_batch(
+    category_name: str, fetch_id: int, pages: List[str], flags: List[int] = None
+):
+    (usable, flagged) = _pending_fetches[fetch_id]
+
+    if flags is None:
+        usable.extend(intern_titles(pages))
+        return
+
+    for page_id, page_flags in zip(intern_titles(pages, flags), flags):
+        (flagged if page_flags else usable).append(page_id)
+
+
+def _order_page_ids(usable, flagged) -> Tuple[array, int]:
+    # Deduplicated ids with the usable ones first, and how many those are.
+    usable = dict.fromkeys(usable)
+    flagged = [page_id for page_id in dict.fromkeys(flagged) if page_id not in usable]
+
+    return (array("I", list(usable) + flagged), len(usable))
+
+
+def finish_category_fetch(
+    category_name: str,
+    fetch_id: int,
+    subcats: List[str] = None,
+    ttl: int = None,
+    synced_at: str = None,
+) -> bool:
+    conn = connection()
+
+    if subcats is None:
+        subcats = []
+
+    if ttl is None:
+        ttl = config.category_cache_ttl()
+
+    (ids, usable_count) = _order_page_ids(*_pending_fetches.pop(fetch_id))
+
+    now = time.time()
+
+    # One statement, so readers see either the old or the new list.
     with conn:
         conn.execute(
-            "INSERT OR IGNORE INTO CategoryCache(category_name, pages) " "VALUES(?, ?)",
-            (category_name, dumps(pages)),
+            "INSERT INTO CategoryCache"
+            "(category_name, pages, subcats, fetched_at, ttl, page_count, page_ids, "
+            "synced_at, full_synced_at, usable_count) "
+            "VALUES(?, '[]', ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(category_name) DO UPDATE SET "
+            "pages = excluded.pages, "
+            "subcats = excluded.subcats, "
+            "fetched_at = excluded.fetched_at, "
+            "ttl = excluded.ttl, "
+            "page_count = excluded.page_count, "
+            "page_ids = excluded.page_ids, "
+            "synced_at = excluded.synced_at, "
+            "full_synced_at = excluded.full_synced_at, "
+            "usable_count = excluded.usable_count",
+            (
+                category_name,
+                dumps(subcats),
+                now,
+                ttl,
+                len(ids),
+                _pack_ids(ids),
+                synced_at,
+                now,
+                usable_count,
+            ),
         )
 
+    invalidate_category(category_name)
+
     return True
 
 
+def category_sync_state(category_name: str) -> Tuple[str | None, float | None]:
+    # (synced_at, full_synced_at) for a cached category, both None if it
+    # can't be synced incrementally (including rows cached before page flags).
+    conn = connection()
+
+    with conn:
+        rows = list(
+            conn.execute(
+                "SELECT synced_at, full_synced_at FROM CategoryCache "
+                "WHERE category_name = ? AND usable_count IS NOT NULL",
+                (category_name,),
+            )
+        )
+
+    return rows[0] if len(rows) > 0 else (None, None)
+
+
+def extend_category(
+    category_name: str,
+    pages: List[str],
+    subcats: List[str],
+    synced_at: str,
+    flags: List[int] = None,
+    ttl: int = None,
+    max_members: int = 0,
+) -> Tuple[int, int]:
+    # Adds members found by an incremental sync to a cached category, keeping
+    # at most max_members pages (0 = no cap), usable ones first. Returns the
+    # resulting (page count, subcategory count).
+    conn = connection()
+
+    if ttl is None:
+        ttl = config.category_cache_ttl()
+
+    if flags is None:
+        flags = [0] * len(pages)
+
+    ids = category_page_ids(category_name)
+    old_usable = category_usable_count(category_name)
+    new_ids = intern_titles(pages, flags)
+
+    (ids, usable_count) = _order_page_ids(
+        list(ids[:old_usable])
+        + [page_id for page_id, page_flags in zip(new_ids, flags) if not page_flags],
+        list(ids[old_usable:])
+        + [page_id for page_id, page_flags in zip(new_ids, flags) if page_flags],
+    )
+
+    if max_members > 0 and len(ids) > max_members:
+        ids = ids[:max_members]
+        usable_count = min(usable_count, max_members)
+    subcats = list(dict.fromkeys(category_cache_subcats(category_name) + subcats))
+
+    with conn:
+        conn.execute(
+            "UPDATE CategoryCache SET "
+            "subcats = ?, fetched_at = ?, ttl = ?, page_count = ?, page_ids = ?, "
+            "synced_at = ?, usable_count = ? "
+            "WHERE category_name = ?",
+            (
+                dumps(subcats),
+                time.time(),
+                ttl,
+                len(ids),
+                _pack_ids(ids),
+                synced_at,
+                usable_count,
+                category_name,
+            ),
+        )
+
+    invalidate_category(category_name)
+
+    return (len(ids), len(subcats))
+
+
+def invalidate_category(category_name: str):
+    _category_cache.invalidate(("ids", category_name))
+    _category_cache.invalidate(("pages", category_name))
+    _category_cache.invalidate(("subcats", category_name))
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"presets": _preset_cache.stats(), "categories": _category_cache.stats()}
+
+
+def abort_category_fetch(category_name: str, fetch_id: int):
+    # Interned titles stay in Pages; they're shared and cheap to keep.
+    _pending_fetches.pop(fetch_id, None)
+
+
+def cache_category(
+    category_name: str, pages: List[str], subcats: List[str] = None, ttl: int = None
+) -> bool:
+    fetch_id = begin_category_fetch(category_name)
+    cache_category_batch(category_name, fetch_id, pages)
+
+    return finish_category_fetch(category_name, fetch_id, subcats, ttl)
+
+
+def category_cache_expired(category_name: str) -> bool:
+    conn = connection()
+
+    with conn:
+        rows = list(
+            conn.execute(
+                "SELECT fetched_at, ttl FROM CategoryCache WHERE category_name = ?",
+                (category_name,),
+            )
+        )
+
+    if len(rows) == 0:
+        return True
+
+    (fetched_at, ttl) = rows[0]
+
+    return fetched_at is None or ttl is None or fetched_at + ttl < time.time()
+
+
+def expired_categories(limit: int = 50) -> List[str]:
+    conn = connection()
+
+    with conn:
+        rows = conn.execute(
+            "SELECT category_name FROM CategoryCache "
+            "WHERE fetched_at IS NULL OR ttl IS NULL OR fetched_at + ttl < ? "
+            "ORDER BY fetched_at IS NOT NULL, fetched_at "
+            "LIMIT ?",
+            (time.time(), limit),
+        )
+
+        return [row[0] for row in rows]
+
+
 def preset_exists(preset_name):
-    global conn
+    conn = connection()
 
     with conn:
         rows = list(
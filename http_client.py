@@ -0,0 +1,208 @@
+import asyncio
+import aiohttp
+import time
+
+from json import loads
+from typing import Dict, Mapping, NamedTuple
+from urllib.parse import urlsplit
+
+import config
+import metrics
+import profiling
+
+# Wikipedia asks API clients to identify themselves, BingoSync only serves browsers.
+_HOST_HEADERS = {
+    "en.wikipedia.org": {
+        "User-Agent": "wiki_bingo_bot (https://github.com/typedef-sorbet/wiki_bingo_bot)",
+        "Accept-Encoding": "gzip, deflate",
+    },
+    "bingosync.com": {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20100101 Firefox/140.0",
+    },
+}
+
+# One keep-alive session (and connection pool) per host, created lazily inside
+# the running event loop.
+_sessions: Dict[str, aiohttp.ClientSession] = {}
+_semaphore = None
+_rate_limiters: Dict[str, "RateLimiter"] = {}
+
+metrics.describe("http_request_seconds", "Outgoing HTTP request latency.")
+metrics.describe("http_requests_total", "Outgoing HTTP requests, by response status.")
+
+
+class HttpError(Exception):
+    pass
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return loads(self.body)
+
+
+class RateLimiter:
+    # Token bucket: `rate` requests per second on average, bursts of `burst`.
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _rate_limiter(host: str) -> RateLimiter | None:
+    # Only the Wikipedia API is throttled, per its API etiquette.
+    if host != urlsplit(config.wiki_api_url()).netloc or config.wiki_rate_limit() <= 0:
+        return None
+
+    limiter = _rate_limiters.get(host)
+
+    if limiter is None:
+        limiter = RateLimiter(config.wiki_rate_limit(), config.wiki_rate_burst())
+        _rate_limiters[host] = limiter
+
+    return limiter
+
+
+def apply_settings():
+    # Called after config.json is reloaded. Existing sessions and the
+    # concurrency limit keep their settings until a restart.
+    for limiter in _rate_limiters.values():
+        limiter.rate = config.wiki_rate_limit()
+        limiter.burst = config.wiki_rate_burst()
+        limiter.tokens = min(limiter.tokens, limiter.burst)
+
+
+def _limiter() -> asyncio.Semaphore:
+    global _semaphore
+
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(config.http_max_concurrency())
+
+    return _semaphore
+
+
+def session_for(url: str) -> aiohttp.ClientSession:
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=config.http_pool_size(),
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=config.http_timeout(), connect=config.http_connect_timeout()
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers=_HOST_HEADERS.get(host, {}),
+        )
+        _sessions[host] = session
+
+    return session
+
+
+def _phase(host: str) -> str:
+    # Which profiling phase a request to this host is charged to.
+    if host == urlsplit(config.wiki_api_url()).netloc:
+        return "wiki"
+    if host == urlsplit(config.bingosync_url()).netloc:
+        return "bingosync"
+
+    return "http"
+
+
+def _endpoint(url: str, params) -> str:
+    # The path, plus which API module was asked for, e.g. "/w/api.php:categorymembers".
+    path = urlsplit(url).path or "/"
+
+    if isinstance(params, Mapping):
+        module = params.get("generator") or params.get("list") or params.get("prop")
+        if module:
+            return f"{path}:{module}"
+
+    return path
+
+
+async def request(method: str, url: str, **kwargs) -> Response:
+    session = session_for(url)
+    host = urlsplit(url).netloc
+    endpoint = _endpoint(url, kwargs.get("params"))
+    rate_limiter = _rate_limiter(host)
+
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
+
+    async with _limiter():
+        started = time.perf_counter()
+        status = "error"
+
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                body = await resp.read()
+                status = str(resp.status)
+                return Response(resp.status, dict(resp.headers), body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise HttpError(f"{method} {url} failed: {err!r}") from err
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("http_request_seconds", elapsed, host=host, endpoint=endpoint)
+            profiling.add_phase_time(_phase(host), elapsed)
+            metrics.inc(
+                "http_requests_total",
+                host=host,
+                endpoint=endpoint,
+                method=method,
+                status=status,
+            )
+
+
+async def get(url: str, params=None, **kwargs) -> Response:
+    return await request("GET", url, params=params, **kwargs)
+
+
+async def post(url: str, data=None, **kwargs) -> Response:
+    return await request("POST", url, data=data, **kwargs)
+
+
+async def get_json(url: str, params=None, **kwargs):
+    resp = await get(url, params=params, **kwargs)
+
+    try:
+        return resp.json()
+    except ValueError as err:
+        raise HttpError(f"GET {url} returned non-JSON body: {resp.body[:200]}") from err
+
+
+async def close():
+    for session in _sessions.values():
+        if not session.closed:
+            await session.close()
+
+    _sessions.clear()
@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import time
+
+from typing import Awaitable, Callable, Dict, Hashable, List, Tuple
+
+import metrics
+
+metrics.describe("job_queue_depth", "Jobs waiting for a worker.")
+metrics.describe("job_queue_running", "Jobs being worked on.")
+metrics.describe("job_queue_submissions_total", "Job submissions, by whether they were queued, joined or rejected.")
+metrics.describe("job_queue_wait_seconds", "Time jobs spent waiting for a worker.")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, keys: List[Hashable], fn: Callable[[], Awaitable]):
+        self.keys = keys
+        self.fn = fn
+        self.future = asyncio.get_running_loop().create_future()
+        # The submitter may have gone away, don't warn about a failed job.
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.enqueued_at = time.monotonic()
+        self.seq = 0
+        self.started = False
+        # Run in the submitter's context, so per-command profiling phases
+        # are charged to the command that asked for the job.
+        self.context = contextvars.copy_context()
+
+
+class JobQueue:
+    # A bounded FIFO drained by a fixed pool of workers. Each job carries one
+    # or more dedupe keys, and submitting while another job with any of the
+    # same keys is waiting or running joins that job instead. Depth, running
+    # jobs and wait times are exported through metrics under the queue's name.
+
+    def __init__(self, name: str, workers: int, max_depth: int):
+        self.name = name
+        self.workers = workers
+        self.max_depth = max_depth
+
+        self._queue: asyncio.Queue | None = None
+        self._jobs: Dict[Hashable, _Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        # Jobs submitted and jobs taken off the queue so far, for positions.
+        self._submitted = 0
+        self._dequeued = 0
+
+    def _start_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+
+        # Tops the pool back up if a worker has died.
+        self._tasks = [task for task in self._tasks if not task.done()]
+
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    def resize(self, workers: int, max_depth: int):
+        # A lower depth only turns away new jobs. Extra workers start with
+        # the next submission; surplus ones stop after finishing a job.
+        self.workers = workers
+        self.max_depth = max_depth
+
+    def _position(self, job: _Job) -> int:
+        if job.started:
+            return 0
+
+        ahead = job.seq - self._dequeued
+
+        return ahead if self._running + ahead > self.workers else 0
+
+    def _update_gauges(self):
+        metrics.set_gauge("job_queue_depth", self._queue.qsize(), queue=self.name)
+        metrics.set_gauge("job_queue_running", self._running, queue=self.name)
+
+    def submit(
+        self, keys: List[Hashable], fn: Callable[[], Awaitable]
+    ) -> Tuple[asyncio.Future, int, bool]:
+        # Returns the job's future, its place in line (0 if a worker will pick
+        # it up straight away), and whether an existing job was joined. The
+        # future is shared between everyone who joined, so await it through
+        # asyncio.shield(). Raises QueueFull instead of waiting.
+        self._start_workers()
+
+        for key in keys:
+            job = self._jobs.get(key)
+
+            if job is not None:
+                metrics.inc("job_queue_submissions_total", queue=self.name, result="duplicate")
+                return (job.future, self._position(job), True)
+
+        waiting = self._queue.qsize()
+
+        if waiting >= self.max_depth:
+            metrics.inc("job_queue_submissions_total", queue=self.name, result="rejected")
+            raise QueueFull(waiting)
+
+        self._submitted += 1
+
+        job = _Job(keys, fn)
+        job.seq = self._submitted
+        for key in keys:
+            self._jobs[key] = job
+
+        self._queue.put_nowait(job)
+        self._update_gauges()
+        metrics.inc("job_queue_submissions_total", queue=self.name, result="queued")
+
+        return (job.future, self._position(job), False)
+
+    async def _work(self):
+        while True:
+            if len(self._tasks) > self.workers:
+                self._tasks.remove(asyncio.current_task())
+                return
+
+            job = await self._queue.get()
+            job.started = True
+            self._dequeued += 1
+            self._running += 1
+            self._update_gauges()
+
+            metrics.observe(
+                "job_queue_wait_seconds",
+                time.monotonic() - job.enqueued_at,
+                queue=self.name,
+            )
+
+            # Whatever the job does, the worker carries on; only cancelling
+            # the worker itself stops it. The future may already be cancelled
+            # if nobody is waiting for it any more.
+            try:
+                result = await asyncio.create_task(job.fn(), context=job.context)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+
+                if asyncio.current_task().cancelling() > 0:
+                    raise
+            except Exception as err:
+                if not job.future.done():
+                    job.future.set_exception(err)
+            except BaseException as err:
+                if not job.future.done():
+                    job.future.set_exception(err)
+                raise
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self._running -= 1
+
+                for key in job.keys:
+                    if self._jobs.get(key) is job:
+                        del self._jobs[key]
+
+                self._queue.task_done()
+                self._update_gauges()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "waiting": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "workers": self.workers,
+            "max_depth": self.max_depth,
+        }
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from typing import Dict, List
+
+import bench
+
+# Fires `!wiki` commands at the dispatcher at a fixed rate, against the same
+# local stand-ins as bench.py, while timing how late a periodic timer wakes up.
+# A late timer means something blocked the event loop.
+
+DEFAULT_MIX = "start=5,preset=3,presets=1,append=1,weight=1"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+
+    for part in mix.split(","):
+        (name, _, weight) = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+
+    return weights
+
+
+def command_args(name: str, preset_names: List[str], entries: List[str]) -> List[str]:
+    preset_name = random.choice(preset_names)
+
+    match name:
+        case "start":
+            return ["start", preset_name]
+        case "preset":
+            return ["preset", preset_name]
+        case "presets":
+            return ["presets"]
+        case "append":
+            return ["preset", "append", preset_name, random.choice(entries)]
+        case "weight":
+            return ["preset", "weight", preset_name, random.choice(entries), "2"]
+
+    raise ValueError(f"Unknown command in mix: {name}")
+
+
+async def watch_loop_lag(interval: float, lags: List[float], stop: asyncio.Event):
+    expected = time.perf_counter() + interval
+
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+
+        now = time.perf_counter()
+        lags.append(max(0.0, now - expected))
+        expected = now + interval
+
+
+def queue_outcomes() -> Dict[str, float]:
+    import metrics
+
+    return {
+        dict(labels)["result"]: count
+        for labels, count in metrics.counters("job_queue_submissions_total").items()
+    }
+
+
+async def run_rate(rate: float, args, wiki_command, preset_names, entries) -> dict:
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {}
+    sqlite_errors = 0
+    lags = []
+
+    async def one(name: str):
+        nonlocal sqlite_errors
+
+        started = time.perf_counter()
+
+        try:
+            ctx = bench.FakeContext(
+                random.randrange(args.users), random.randrange(args.channels)
+            )
+            await wiki_command.callback(ctx, *command_args(name, preset_names, entries))
+        except sqlite3.Error as err:
+            sqlite_errors += 1
+            errors[type(err).__name__] = errors.get(type(err).__name__, 0) + 1
+        except Exception as err:
+            errors[type(err).__name__] = errors.get(type(err).__name__, 0) + 1
+
+        latencies[name].append(time.perf_counter() - started)
+
+    queued_before = queue_outcomes()
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(args.lag_interval / 1000, lags, stop))
+
+    # Open loop: commands are started on schedule whether or not earlier ones
+    # have finished, so latency climbs once the bot saturates.
+    tasks = []
+    started = time.perf_counter()
+    total = int(rate * args.duration)
+
+    for i in range(total):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        name = random.choices(names, weights=weights)[0]
+        tasks.append(asyncio.create_task(one(name)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await watcher
+
+    return {
+        "rate": rate,
+        "completed": total,
+        "throughput": total / elapsed if elapsed > 0 else 0.0,
+        "latencies": latencies,
+        "lags": lags,
+        "errors": errors,
+        "sqlite_errors": sqlite_errors,
+        "game_queue": {
+            result: count - queued_before.get(result, 0)
+            for result, count in queue_outcomes().items()
+        },
+    }
+
+
+def ms(samples: List[float], pct: float) -> str:
+    if len(samples) == 0:
+        return "-"
+
+    return f"{bench.percentile(samples, pct) * 1000:.1f}"
+
+
+def print_report(results: List[dict]):
+    for result in results:
+        print(
+            f"rate {result['rate']:g}/s: {result['completed']} commands, "
+            f"{result['throughput']:.1f}/s completed, "
+            f"loop lag p50 {ms(result['lags'], 50)} ms, "
+            f"p99 {ms(result['lags'], 99)} ms, "
+            f"max {max(result['lags'], default=0) * 1000:.1f} ms, "
+            f"sqlite errors {result['sqlite_errors']}"
+        )
+        print(f"  {'command':<10}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+        for name, samples in result["latencies"].items():
+            print(
+                f"  {name:<10}{len(samples):>7}{ms(samples, 50):>10}"
+                f"{ms(samples, 99):>10}{ms(samples, 100):>10}"
+            )
+
+        if len(result["game_queue"]) > 0:
+            print(f"  game queue: {result['game_queue']}")
+
+        if len(result["errors"]) > 0:
+            print(f"  errors: {result['errors']}")
+
+
+async def run(args) -> List[dict]:
+    fake_wiki = bench.FakeWiki(
+        args.categories, args.category_size, args.subcats, args.latency_ms / 1000
+    )
+    fake_bingosync = bench.FakeBingoSync(args.latency_ms / 1000)
+    (runners, wiki_url, bingosync_url) = await bench.start_servers(fake_wiki, fake_bingosync)
+
+    bench.use_stand_ins(wiki_url, bingosync_url, db_file=args.db, wiki_rate_limit=args.rate_limit)
+
+    # Imported only now, so they pick up the overridden settings.
+    import db
+    import http_client
+    import main
+
+    db.migrate_db()
+
+    category_names = [f"Bench {i}" for i in range(args.categories)]
+    entries = category_names + [f"Article {n}" for n in range(10)]
+    preset_names = [f"load{i}" for i in range(args.presets)]
+
+    for i, preset_name in enumerate(preset_names):
+        await db.create_preset(
+            preset_name, category_names[i % len(category_names) :] + entries[-5:]
+        )
+
+    results = []
+
+    try:
+        for rate in args.rate:
+            results.append(
+                await run_rate(rate, args, main._wiki, preset_names, entries)
+            )
+    finally:
+        await http_client.close()
+        await bench.stop_servers(runners)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the !wiki command dispatcher against local API stand-ins."
+    )
+    parser.add_argument(
+        "--rate", type=float, nargs="+", default=[5, 20, 50],
+        help="commands per second; several values run one after another",
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds per rate")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command=weight,...")
+    parser.add_argument("--presets", type=int, default=4)
+    parser.add_argument("--users", type=int, default=1000, help="distinct command authors")
+    parser.add_argument("--channels", type=int, default=100, help="distinct channels")
+    parser.add_argument("--categories", type=int, default=4)
+    parser.add_argument("--category-size", type=int, default=2000)
+    parser.add_argument("--subcats", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=20, help="simulated server latency")
+    parser.add_argument("--rate-limit", type=float, default=0, help="wiki_rate_limit to run with")
+    parser.add_argument("--lag-interval", type=float, default=10, help="lag timer period in ms")
+    parser.add_argument(
+        "--db", help="database to start from; a temporary copy is load-tested, never the file itself"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db is None:
+            args.db = os.path.join(tmpdir, "loadtest.db")
+        else:
+            args.db = bench.copy_db(args.db, tmpdir)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(args))
+
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import threading
+
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+_MISSING = object()
+
+
+def approx_size(value) -> int:
+    # Rough in-memory footprint of the values we cache: strings, packed id
+    # arrays, and lists or dicts of strings.
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, array):
+        return 64 + len(value) * value.itemsize
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 56 + sum(8 + approx_size(item) for item in value)
+    return 32
+
+
+class LRUCache:
+    # Bounded by entry count and, optionally, by approximate size in bytes.
+    # Values are shared with callers, who must not mutate them. Safe to use
+    # from executor threads as well as the event loop.
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        max_bytes: int = 0,
+        size_fn: Callable[[Any], int] = approx_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+
+        self._entries: OrderedDict = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def put(self, key: Hashable, value):
+        size = self.size_fn(value) if self.max_bytes > 0 else 0
+
+        with self._lock:
+            self._remove(key)
+
+            # Never cache a single value that would blow the whole budget.
+            if self.max_bytes > 0 and size > self.max_bytes:
+                return
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes > 0 and self.total_bytes > self.max_bytes
+            ):
+                (old_key, _) = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def resize(self, max_entries: int, max_bytes: int = 0):
+        with self._lock:
+            # Sizes aren't measured while there's no byte limit.
+            if max_bytes > 0 and self.max_bytes <= 0:
+                for key, value in self._entries.items():
+                    self._sizes[key] = self.size_fn(value)
+                self.total_bytes = sum(self._sizes.values())
+
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes > 0 and self.total_bytes > self.max_bytes
+            ):
+                (old_key, _) = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        if key in self._entries:
+            del self._entries[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,26 +1,27 @@
+import asyncio
 import discord
 import config
 import urllib
-import requests
 import logging
 
-import sqlite3 as sql
-
 from discord.ext import commands, tasks
-from bs4 import BeautifulSoup as Soup
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-
 from enum import Enum
 
 from json import dumps
 
 from typing import List, Dict, Tuple
 
+import bingosync
+import board
 import db
+import http_client
+import jobqueue
+import metrics
+import profiling
+import warmer
 import wiki
-import random
 
 
 class WikiError(Enum):
@@ -30,6 +31,11 @@ class WikiError(Enum):
 
 logging.basicConfig(level=logging.INFO)
 bot = commands.Bot(command_prefix="!", intents=discord.Intents(34305))
+bingosync_client = bingosync.BingoSyncClient()
+game_queue = jobqueue.JobQueue("games", config.game_workers(), config.game_queue_depth())
+
+metrics.describe("command_seconds", "!wiki command latency.")
+metrics.describe("command_errors_total", "!wiki commands that raised.")
 
 # Trick the site into thinking we're a browser
 headers = {
@@ -37,8 +43,6 @@ headers = {
     (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
 }
 
-DB_NAME = "wiki.db"
-
 
 # Yes, this pattern fucking sucks, I know
 def renderMessage(data):
@@ -59,11 +63,12 @@ def renderMessage(data):
             else:
                 res = "\n".join(
                     f'{entry["entry_name"]} _({entry["entry_type"]})_'
+                    + (f' x{entry["weight"]:g}' if entry["weight"] != 1 else "")
                     for entry in contents
                 )
 
         case {"type": "start_game", "room_code": room_code}:
-            res += f"BingoSync game created: https://bingosync.com{room_code}"
+            res += f"BingoSync game created: {config.bingosync_url().rstrip('/')}{room_code}"
 
         # General purpose confirmation
         case True:
@@ -93,7 +98,8 @@ def renderMessage(data):
 async def sendMessageFromData(ctx, data):
     # Render the data contained in the data struct, and send it
     try:
-        await ctx.send(renderMessage(data))
+        with profiling.phase("render"):
+            await ctx.send(renderMessage(data))
 
     except discord.HTTPException as httpErr:
         print(f"Failed to send message: {httpErr}")
@@ -112,9 +118,94 @@ async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
     print("-----")
 
+    if not refresh_category_cache.is_running():
+        refresh_category_cache.change_interval(minutes=config.cache_refresh_interval())
+        refresh_category_cache.start()
+
+    if not reload_config.is_running():
+        reload_config.change_interval(seconds=config.settings().config_poll_interval)
+        reload_config.start()
+
+    if config.metrics_file() and not export_metrics.is_running():
+        export_metrics.change_interval(seconds=config.metrics_interval())
+        export_metrics.start()
+
+    # Fetch the categories of the presets people actually play, so their first
+    # `!wiki start` doesn't pay for it.
+    warmer.warm_most_used()
+
+
+# Background tasks go here...
+@tasks.loop(seconds=30)
+async def reload_config():
+    # A stat() per poll; config.json is only re-read when its mtime changes.
+    changed = config.reload()
+
+    if changed:
+        print(f"Reloaded config.json, changed: {', '.join(changed)}")
+
+        needs_restart = [name for name in changed if name in config.RESTART_REQUIRED]
+        if len(needs_restart) > 0:
+            print(f"These only take effect after a restart: {', '.join(needs_restart)}")
+
+        db.apply_settings()
+        http_client.apply_settings()
+        board.apply_settings()
+        profiling.apply_settings()
+        game_queue.resize(config.game_workers(), config.game_queue_depth())
+
+        reload_config.change_interval(seconds=config.settings().config_poll_interval)
+        refresh_category_cache.change_interval(minutes=config.cache_refresh_interval())
+        export_metrics.change_interval(seconds=config.metrics_interval())
+
+
+@tasks.loop(seconds=15)
+async def export_metrics():
+    try:
+        metrics.write_prometheus_file(config.metrics_file())
+    except OSError as err:
+        print(f"export_metrics: unable to write {config.metrics_file()}: {err}")
+
+
+@tasks.loop(minutes=30)
+async def refresh_category_cache():
+    # Re-fetch the stalest categories; readers keep getting the old copy until
+    # each refresh lands.
+    for category_name in db.expired_categories(config.cache_refresh_batch()):
+        if not await wiki.refresh_category(category_name):
+            print(f"refresh_category_cache: failed to refresh {category_name}")
+
+
+# Subcommand names used as metric labels; anything else is "unknown", so
+# arbitrary user input can't create new series.
+PRESET_SUBCOMMANDS = ("create", "delete", "update", "append", "remove", "weight", "warm")
+COMMANDS = ("preset", "presets", "start", "stats", "profile", "help", "github")
+
+
+def command_name(args) -> str:
+    match args:
+        case ["preset", subcommand, _, *_] if subcommand in PRESET_SUBCOMMANDS:
+            return f"preset {subcommand}"
+        case [command, *_] if command in COMMANDS:
+            return command
+
+    return "unknown"
+
 
 @bot.command(name="wiki")
 async def _wiki(ctx, *args):
+    name = command_name(args)
+
+    try:
+        with metrics.timer("command_seconds", command=name):
+            with profiling.invocation(name, args):
+                await dispatch(ctx, args)
+    except Exception:
+        metrics.inc("command_errors_total", command=name)
+        raise
+
+
+async def dispatch(ctx, args):
     match args:
         # Preset Management
         case ["preset"] | ["presets"]:
@@ -135,6 +226,12 @@ async def _wiki(ctx, *args):
         case ["preset", "remove", preset_name, *entries]:
             await remove_from_preset(ctx, preset_name, entries)
 
+        case ["preset", "weight", preset_name, entry_name, weight]:
+            await set_entry_weight(ctx, preset_name, entry_name, weight)
+
+        case ["preset", "warm", preset_name]:
+            await warm_preset(ctx, preset_name)
+
         case ["preset", preset_name]:
             await list_preset_contents(ctx, preset_name)
 
@@ -146,6 +243,12 @@ async def _wiki(ctx, *args):
             await start_game(ctx, "TODO", preset_name)
 
         # General
+        case ["stats"]:
+            await show_stats(ctx)
+
+        case ["profile", *options]:
+            await configure_profiling(ctx, options)
+
         case ["help"]:
             await sendMessageFromData(
                 ctx,
@@ -158,6 +261,8 @@ async def _wiki(ctx, *args):
                     "`!wiki preset append PRESET_NAME (CATEGORY|ARTICLE)...` - Append the listed categories/articles to the named preset.",
                     "`!wiki preset update PRESET_NAME (CATEGORY|ARTICLE)...` - Replace the category/article list of the named preset with the given list.",
                     "`!wiki preset remove PRESET_NAME (CATEGORY|ARTICLE)...` - Remove the listed categories/articles from the named preset.",
+                    "`!wiki preset weight PRESET_NAME (CATEGORY|ARTICLE) WEIGHT` - Set how often the given category/article fills a square, relative to the rest of the preset (default 1, 0 to never use it).",
+                    "`!wiki preset warm PRESET_NAME` - Fetch every category in the named preset ahead of time, so starting a game with it is fast.",
                     "`!wiki preset delete PRESET_NAME` - Delete the named preset.",
                     "",
                     "**Game Management**",
@@ -166,6 +271,8 @@ async def _wiki(ctx, *args):
                     "",
                     "**General**",
                     "",
+                    "`!wiki stats` - Show command latencies, API call counts and cache hit rates.",
+                    "`!wiki profile [on|off|threshold SECONDS|slow]` - _(admins)_ Show or change command profiling, or list recent slow commands.",
                     "`!wiki help` - Show this help message.",
                     "`!wiki github` - Returns a link to this bot's GitHub repo."
                 ])
@@ -178,6 +285,126 @@ async def _wiki(ctx, *args):
             await sendMessageFromData(ctx, "Unknown command. Type `!wiki help` for a list of commands.")
 
 
+def _latency_line(labels, histogram) -> str:
+    label = " ".join(str(value) for (_, value) in labels)
+    p50 = histogram.quantile(0.5) * 1000
+    p99 = histogram.quantile(0.99) * 1000
+
+    return f"`{label}` {histogram.count}x, avg {histogram.sum / histogram.count * 1000:.0f}ms, p50 ≤{p50:g}ms, p99 ≤{p99:g}ms"
+
+
+async def show_stats(ctx):
+    lines = ["**Commands**"]
+    lines.extend(_latency_line(*series) for series in metrics.summary("command_seconds")[:8])
+
+    lines.extend(["", "**HTTP requests**"])
+    lines.extend(_latency_line(*series) for series in metrics.summary("http_request_seconds")[:8])
+
+    lines.extend(["", "**SQLite queries**"])
+    lines.extend(_latency_line(*series) for series in metrics.summary("sqlite_query_seconds")[:6])
+
+    sqlite_errors = sum(metrics.counters("sqlite_errors_total").values())
+    if sqlite_errors > 0:
+        lines.append(f"{sqlite_errors:g} failed queries")
+
+    lookups = {
+        dict(labels)["result"]: count
+        for labels, count in metrics.counters("category_cache_lookups_total").items()
+    }
+    total = sum(lookups.values())
+    served = lookups.get("hit", 0) + lookups.get("stale", 0)
+
+    lines.extend(["", "**Caches**"])
+    lines.append(
+        f"CategoryCache: {served / total:.0%} served from cache "
+        f'({lookups.get("hit", 0):g} hits, {lookups.get("stale", 0):g} stale, {lookups.get("miss", 0):g} misses)'
+        if total > 0
+        else "CategoryCache: no lookups yet"
+    )
+
+    for cache_name, stats in db.cache_stats().items():
+        lines.append(
+            f'In-memory {cache_name}: {stats["entries"]} entries, {stats["bytes"] // 1024} KiB, '
+            f'{stats["hits"]} hits, {stats["misses"]} misses, {stats["evictions"]} evictions'
+        )
+
+    pool = board.pool_stats()
+    lines.append(f"Board pool: {sum(pool.values())} boards ready for {len(pool)} presets")
+
+    warming = warmer.warm_stats()
+    lines.append(
+        f'Cache warming: {warming["scheduled"]} presets scheduled, '
+        f'{warming["pending"]} due to be warmed again'
+    )
+
+    queue = game_queue.stats()
+    lines.append(
+        f'Game queue: {queue["waiting"]}/{queue["max_depth"]} waiting, '
+        f'{queue["running"]}/{queue["workers"]} being created'
+    )
+    lines.extend(_latency_line(*series) for series in metrics.summary("job_queue_wait_seconds"))
+
+    await sendMessageFromData(ctx, "\n".join(lines)[:2000])
+
+
+def is_admin(ctx) -> bool:
+    permissions = getattr(ctx.author, "guild_permissions", None)
+
+    return permissions is not None and permissions.administrator
+
+
+async def configure_profiling(ctx, options):
+    if not is_admin(ctx):
+        await sendMessageFromData(ctx, (False, "Only server administrators can change profiling."))
+        return
+
+    match options:
+        case ["on"]:
+            profiling.set_enabled(True)
+
+        case ["off"]:
+            profiling.set_enabled(False)
+
+        case ["threshold", seconds]:
+            try:
+                profiling.set_threshold(float(seconds))
+            except ValueError:
+                await sendMessageFromData(ctx, (False, f'"{seconds}" is not a number.'))
+                return
+
+        case ["slow"]:
+            lines = [
+                f'`{" ".join(record["args"])}` {record["seconds"]:.2f}s - '
+                + ", ".join(
+                    f"{phase} {seconds:.2f}s"
+                    for phase, seconds in sorted(
+                        record["phases"].items(), key=lambda item: -item[1]
+                    )
+                )
+                + (f' (profile: {record["profile"]})' if record["profile"] else "")
+                for record in profiling.slow_invocations()[:10]
+            ]
+
+            await sendMessageFromData(
+                ctx, "\n".join(lines)[:2000] if len(lines) > 0 else "No slow commands recorded."
+            )
+            return
+
+        case []:
+            pass
+
+        case _:
+            await sendMessageFromData(ctx, "Unknown command. Type `!wiki help` for a list of commands.")
+            return
+
+    await sendMessageFromData(
+        ctx,
+        f'Profiling is {"on" if profiling.enabled() else "off"}; commands slower than '
+        f"{profiling.threshold():g}s are recorded"
+        + (f" and profiled into {config.profile_dir()}/." if profiling.enabled() else "."),
+    )
+
+
 async def list_presets(ctx):
     data = {"type": "list_presets", "presets": db.presets()}
 
@@ -195,145 +422,182 @@ async def list_preset_contents(ctx, preset_name):
 
 
 async def create_preset(ctx, preset_name, entries):
-    await sendMessageFromData(ctx, db.create_preset(preset_name, entries))
+    res = await db.create_preset(preset_name, entries)
+    board.invalidate_pool(preset_name)
+
+    if res[0]:
+        warmer.schedule_warm(preset_name)
+
+    await sendMessageFromData(ctx, res)
 
 
 async def delete_preset(ctx, preset_name):
-    await sendMessageFromData(ctx, db.delete_preset(preset_name))
+    res = db.delete_preset(preset_name)
+    board.invalidate_pool(preset_name)
+
+    await sendMessageFromData(ctx, res)
 
 
 async def update_preset(ctx, preset_name, entries):
-    await sendMessageFromData(ctx, db.update_preset(preset_name, entries))
+    res = await db.update_preset(preset_name, entries)
+    board.invalidate_pool(preset_name)
+
+    if res[0]:
+        warmer.schedule_warm(preset_name)
+
+    await sendMessageFromData(ctx, res)
 
 
 async def append_to_preset(ctx, preset_name, entries):
-    await sendMessageFromData(ctx, db.append_to_preset(preset_name, entries))
+    res = await db.append_to_preset(preset_name, entries)
+    board.invalidate_pool(preset_name)
 
+    if res[0]:
+        warmer.schedule_warm(preset_name)
 
-async def remove_from_preset(ctx, preset_name, entries):
-    await sendMessageFromData(ctx, db.remove_from_preset(preset_name, entries))
+    await sendMessageFromData(ctx, res)
 
 
-async def start_game(ctx, game_type, preset_name):
-    # Here's where the rubber meets the road.
-    # Start a session, then issue a GET request to the main bingosync site
-    # to get the CSRF token.
+async def remove_from_preset(ctx, preset_name, entries):
+    res = db.remove_from_preset(preset_name, entries)
+    board.invalidate_pool(preset_name)
 
-    session = requests.Session()
+    await sendMessageFromData(ctx, res)
 
-    resp = session.get("https://bingosync.com/")
 
-    if resp.status_code != 200:
-        await sendMessageFromData(
-            ctx,
-            (
-                False,
-                f"GET request to bingosync.com gave status code {resp.status_code}",
-            ),
-        )
+async def set_entry_weight(ctx, preset_name, entry_name, weight):
+    try:
+        weight = float(weight)
+    except ValueError:
+        await sendMessageFromData(ctx, (False, f'"{weight}" is not a number.'))
         return
 
-    # The csrf middleware token is embedded in the response HTML, grab it.
-    soup = BeautifulSoup(resp.content, "html.parser")
-    csrf_token = soup.find("input", {"name": "csrfmiddlewaretoken"}).get("value", "")
+    res = db.set_entry_weight(preset_name, entry_name, weight)
+    board.invalidate_pool(preset_name)
 
-    if len(csrf_token) == 0:
-        await sendMessageFromData(
-            ctx, (False, "Unable to find CSRF middleware token in response HTML.")
-        )
+    await sendMessageFromData(ctx, res)
+
+
+async def warm_preset(ctx, preset_name):
+    if not db.preset_exists(preset_name):
+        await sendMessageFromData(ctx, WikiError.PRESET_NOT_EXISTS_ERROR)
         return
 
-    print(f"Found csrfmiddlewaretoken {csrf_token}")
+    total = len(db.preset_categories(preset_name))
 
-    preset_json = dumps(generate_board_for_preset(preset_name))
-    print(f'Generated board: "{preset_json}"')
+    if total == 0:
+        await sendMessageFromData(ctx, f'Preset "{preset_name}" has no categories to warm.')
+        return
 
-    post_headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Connection": "keepalive",
-        "Accept": "text/html,application/xhtml+xml,application/xml",
-        "Accept-Encoding": "gzip, deflate, br, zstd",
-        "Accept-Language": "en-US,en;q=0.5",
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20100101 Firefox/140.0",
-    }
+    message = await ctx.send(f"Warming {preset_name}: 0/{total} categories...")
 
-    post_params = {
-        "room_name": "discord bot test",
-        "passphrase": "youllneverguess",
-        "nickname": "wikibot",
-        "game_type": "18",  # custom
-        "variant_type": "172",  # randomized
-        "custom_json": preset_json,
-        "lockout_mode": "2",  # TODO: make this configurable
-        "seed": "",  # TODO: make this configurable
-        "hide_card": "on",
-        "csrfmiddlewaretoken": csrf_token,
-    }
+    async def on_progress(done, total, category_name):
+        await message.edit(
+            content=f"Warming {preset_name}: {done}/{total} categories ({category_name})..."
+        )
+
+    (warmed, total) = await warmer.warm_preset(preset_name, on_progress)
 
-    resp = session.post(
-        "https://bingosync.com/",
-        data=post_params,
-        headers=post_headers,
-        allow_redirects=False,
+    await message.edit(
+        content=f"Warmed {preset_name}: {warmed}/{total} categories cached."
     )
 
-    if "Location" not in resp.headers:  # File Found
+
+async def start_game(ctx, game_type, preset_name):
+    # Here's where the rubber meets the road. Games are created by a fixed
+    # pool of workers; repeat requests for the same preset from the same user
+    # or channel collapse into the one already under way.
+    if not db.preset_exists(preset_name):
+        await sendMessageFromData(ctx, WikiError.PRESET_NOT_EXISTS_ERROR)
+        return
+
+    db.record_preset_use(preset_name)
+
+    keys = [
+        ("user", getattr(ctx.author, "id", None), preset_name),
+        ("channel", getattr(ctx.channel, "id", None), preset_name),
+    ]
+
+    try:
+        (game, position, joined) = game_queue.submit(keys, lambda: create_game(preset_name))
+    except jobqueue.QueueFull as err:
         await sendMessageFromData(
             ctx,
-            (
-                False,
-                f"Got unexpected status code from POST request {resp.status_code} with no Location header",
-            ),
+            (False, f"Busy: {err.args[0]} games are already waiting. Try again in a minute."),
         )
-        print(f"POST request status code: {resp.status_code}")
-        print(f"POST request headers: {resp.headers}")
-        # print(f"POST request content: {resp.content}")
-        soup = BeautifulSoup(resp.content, "html.parser")
-        alert = soup.find("div", {"class": "alert"}).get_text()
-        print(f"Alert block text: {alert}")
         return
 
-    room_code = resp.headers["Location"]
+    if joined:
+        await sendMessageFromData(
+            ctx, f'A game with preset "{preset_name}" is already being created here, hang on.'
+        )
+    elif position > 0:
+        await sendMessageFromData(ctx, f"Busy, your game is number {position} in the queue.")
 
-    await sendMessageFromData(ctx, {"type": "start_game", "room_code": room_code})
+    # Shielded: the future is shared with anyone who joined, and this command
+    # being cancelled shouldn't cancel the game for them.
+    await sendMessageFromData(ctx, await asyncio.shield(game))
 
 
-def generate_board_for_preset(
-    preset_name: str, cat_depth: int = 500
-) -> List[Dict[str, str]]:
-    pages = []
+async def create_game(preset_name):
+    # The preset may have been deleted while the game was queued.
+    if not db.preset_exists(preset_name):
+        return WikiError.PRESET_NOT_EXISTS_ERROR
 
-    preset_entries = db.preset_contents(preset_name)
+    preset_json = await board.take_board(preset_name)
 
-    for entry in preset_entries:
-        if entry["entry_type"] == db.EntryType.ARTICLE:
-            pages.append(entry["entry_name"])
-        else:
-            pages.extend(wiki.category_contents(entry["entry_name"]))
+    if preset_json is None:
+        return (
+            False,
+            f'Preset "{preset_name}" doesn\'t have enough usable pages for a {board.BOARD_SIZE}-square board.',
+        )
 
-    # Pages fully loaded, randomly select 25 of them.
-    return [{"name": page_name} for page_name in random.sample(pages, 25)]
+    print(f'Generated board: "{preset_json}"')
+
+    try:
+        room_code = await bingosync_client.create_room(preset_json)
+    except bingosync.BingoSyncError as err:
+        return (False, str(err))
+
+    return {"type": "start_game", "room_code": room_code}
+
+
+async def generate_board_for_preset(
+    preset_name: str, cat_depth: int = None
+) -> List[Dict[str, str]]:
+    return [
+        {"name": page_name}
+        for page_name in await board.sample_board(preset_name, cat_depth)
+    ]
 
 
 # Database utility functions
 
 
 def preset_as_json_string(preset_name):
-    conn = sql.connect(DB_NAME)
-
-    with conn:
-        contents = str(
-            list(
-                conn.execute(
-                    "SELECT contents FROM presets WHERE preset_name = ?", (preset_name,)
-                )
-            )[0][0]
-        )
+    contents = db.preset_contents(preset_name)
 
     return dumps(
-        [{"name": article} for article in contents.split(",")], separators=(",", ":")
+        [{"name": entry["entry_name"]} for entry in contents], separators=(",", ":")
     )
 
 
+async def run_bot():
+    db.migrate_db()
+
+    metrics_runner = None
+    if config.metrics_port() > 0:
+        metrics_runner = await metrics.serve(config.metrics_port())
+
+    try:
+        async with bot:
+            await bot.start(config.token())
+    finally:
+        await http_client.close()
+
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
 if __name__ == "__main__":
-    bot.run(config.token())
+    asyncio.run(run_bot())
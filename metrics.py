@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# In-process counters, gauges and latency histograms, keyed by metric name and label
+# values. Recording is a dict update under an uncontended lock, so it's cheap
+# enough for every query and request. Exported as Prometheus text format.
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Reentrant, in case a finalizer records something while this thread holds it.
+_lock = threading.RLock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_gauges: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], "Histogram"] = {}
+_help: Dict[str, str] = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket the quantile falls in; inf past the last.
+        rank = q * self.count
+        seen = 0
+
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+
+        return float("inf")
+
+
+def describe(name: str, help_text: str):
+    _help[name] = help_text
+
+
+def _key(name: str, labels: dict) -> Tuple[str, Tuple]:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    key = _key(name, labels)
+
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+
+    with _lock:
+        histogram = _histograms.get(key)
+
+        if histogram is None:
+            histogram = Histogram()
+            _histograms[key] = histogram
+
+        histogram.observe(seconds)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def counters(name: str) -> Dict[Tuple, float]:
+    # {label items: value} for one counter.
+    with _lock:
+        return {key[1]: value for key, value in _counters.items() if key[0] == name}
+
+
+def histograms(name: str) -> Dict[Tuple, Histogram]:
+    with _lock:
+        return {key[1]: value for key, value in _histograms.items() if key[0] == name}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: Tuple, extra: str = "") -> str:
+    parts = [f'{label}="{_escape(value)}"' for label, value in labels]
+
+    if extra:
+        parts.append(extra)
+
+    return "{" + ",".join(parts) + "}" if len(parts) > 0 else ""
+
+
+def render_prometheus() -> str:
+    lines = []
+
+    with _lock:
+        counter_items = sorted(_counters.items())
+        gauge_items = sorted(_gauges.items())
+        histogram_items = sorted(_histograms.items(), key=lambda item: item[0])
+
+    typed = set()
+
+    for (name, labels), value in counter_items:
+        if name not in typed:
+            typed.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+
+        lines.append(f"{name}{_labels_text(labels)} {value:g}")
+
+    for (name, labels), value in gauge_items:
+        if name not in typed:
+            typed.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+
+        lines.append(f"{name}{_labels_text(labels)} {value:g}")
+
+    for (name, labels), histogram in histogram_items:
+        if name not in typed:
+            typed.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), histogram.buckets):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            le_label = f'le="{le}"'
+            lines.append(f"{name}_bucket{_labels_text(labels, le_label)} {cumulative}")
+
+        lines.append(f"{name}_sum{_labels_text(labels)} {histogram.sum:g}")
+        lines.append(f"{name}_count{_labels_text(labels)} {histogram.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path: str):
+    # Written to a temporary file and renamed, so scrapers (e.g. the node
+    # exporter's textfile collector) never see a partial file.
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w") as outfile:
+        outfile.write(render_prometheus())
+
+    os.replace(tmp_path, path)
+
+
+async def serve(port: int, host: str = "127.0.0.1"):
+    # Serves /metrics on a local port. Returns the aiohttp runner to clean up.
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+def summary(name: str) -> List[Tuple[Tuple, Histogram]]:
+    # A histogram's series, busiest first.
+    return sorted(histograms(name).items(), key=lambda item: -item[1].count)
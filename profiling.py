@@ -0,0 +1,144 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List
+
+import config
+
+# Per-invocation phase timings for `!wiki` commands, a ring buffer of recent
+# slow invocations, and optional cProfile captures of the slow ones. Phase
+# times add up concurrent requests/queries, so they can exceed the wall time.
+#
+# cProfile sees everything on the event loop thread while it's enabled, so a
+# capture includes whatever other commands ran concurrently. Only one command
+# is profiled at a time.
+
+_phases: ContextVar[Dict[str, float] | None] = ContextVar("profiling_phases", default=None)
+_slow: deque = deque(maxlen=config.slow_command_history())
+_enabled = None
+_threshold = None
+_profiler_busy = False
+
+
+def apply_settings():
+    # Called after config.json is reloaded; keeps the newest slow commands.
+    global _slow
+
+    _slow = deque(_slow, maxlen=config.slow_command_history())
+
+
+def enabled() -> bool:
+    # Set at runtime by the admin command, otherwise from config.json.
+    return config.profile_commands() if _enabled is None else _enabled
+
+
+def set_enabled(value: bool):
+    global _enabled
+
+    _enabled = value
+
+
+def threshold() -> float:
+    return config.profile_threshold() if _threshold is None else _threshold
+
+
+def set_threshold(seconds: float):
+    global _threshold
+
+    _threshold = seconds
+
+
+def add_phase_time(phase: str, seconds: float):
+    # Charges time to the command currently running in this context, if any.
+    phases = _phases.get()
+
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - started)
+
+
+def _write_profile(profiler: cProfile.Profile, record: dict) -> str:
+    directory = config.profile_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(record["started"]))
+    base = os.path.join(directory, f"{stamp}-{record['command'].replace(' ', '_')}")
+
+    profiler.dump_stats(f"{base}.prof")
+
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+
+    with open(f"{base}.txt", "w") as outfile:
+        outfile.write(json.dumps({k: v for k, v in record.items() if k != "profile"}, indent=2))
+        outfile.write("\n\n")
+        outfile.write(report.getvalue())
+
+    return f"{base}.prof"
+
+
+@contextmanager
+def invocation(command: str, args: List[str]):
+    global _profiler_busy
+
+    record = {
+        "command": command,
+        "args": list(args),
+        "started": time.time(),
+        "phases": {},
+        "profile": None,
+    }
+    token = _phases.set(record["phases"])
+
+    profiler = None
+    if enabled() and not _profiler_busy:
+        profiler = cProfile.Profile()
+        _profiler_busy = True
+        profiler.enable()
+
+    started = time.perf_counter()
+
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - started
+
+        if profiler is not None:
+            profiler.disable()
+            _profiler_busy = False
+
+        _phases.reset(token)
+
+        if record["seconds"] >= threshold():
+            record["phases"]["other"] = max(
+                0.0, record["seconds"] - sum(record["phases"].values())
+            )
+
+            if profiler is not None:
+                try:
+                    record["profile"] = _write_profile(profiler, record)
+                except OSError as err:
+                    print(f"profiling: unable to write profile: {err}")
+
+            _slow.append(record)
+
+
+def slow_invocations() -> List[dict]:
+    # Recent slow invocations, slowest first.
+    return sorted(_slow, key=lambda record: -record["seconds"])
@@ -0,0 +1,73 @@
+import asyncio
+
+from typing import Awaitable, Callable, Dict, Hashable, Iterable
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key into one: the first caller
+    # does the work, everyone who arrives while it is running awaits the same
+    # result (or exception).
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _claim(self, key: Hashable) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting on a failed call, don't warn about it.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+
+        return future
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._claim(key)
+
+        try:
+            result = await fn()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    async def do_many(
+        self, keys: Iterable[Hashable], fn: Callable[[list], Awaitable[dict]]
+    ) -> dict:
+        # Batch version: fn is called once with only the keys nobody else is
+        # already fetching, and must return a {key: result} dict for them.
+        keys = list(dict.fromkeys(keys))
+
+        waiting = {key: self._calls[key] for key in keys if key in self._calls}
+        mine = {key: self._claim(key) for key in keys if key not in waiting}
+
+        results = {}
+
+        try:
+            if len(mine) > 0:
+                results = await fn(list(mine))
+        except BaseException as err:
+            for future in mine.values():
+                future.set_exception(err)
+            raise
+        else:
+            for key, future in mine.items():
+                future.set_result(results.get(key))
+        finally:
+            for key in mine:
+                del self._calls[key]
+
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+
+        return results
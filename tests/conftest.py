@@ -0,0 +1,38 @@
+import os
+import sys
+
+# The bot's modules live flat at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # Points db at an empty database file, with the in-memory caches emptied.
+    import db
+
+    path = str(tmp_path / "wiki.db")
+
+    db.close_connection()
+    monkeypatch.setattr(db, "DB_FILE", path)
+    db._preset_cache.clear()
+    db._category_cache.clear()
+    db.dump_index_changed()
+
+    yield path
+
+    db.close_connection()
+    db._preset_cache.clear()
+    db._category_cache.clear()
+    db.dump_index_changed()
+
+
+@pytest.fixture
+def temp_db(db_path):
+    # A freshly migrated database.
+    import db
+
+    db.migrate_db()
+
+    return db
@@ -0,0 +1,14 @@
+-- Synthetic categorylinks dump in the newer format, where the category is a
+-- linktarget id.
+DROP TABLE IF EXISTS `categorylinks`;
+CREATE TABLE `categorylinks` (
+  `cl_from` int(8) unsigned NOT NULL DEFAULT 0,
+  `cl_sortkey` varbinary(230) NOT NULL DEFAULT '',
+  `cl_sortkey_prefix` varbinary(255) NOT NULL DEFAULT '',
+  `cl_timestamp` timestamp NOT NULL DEFAULT current_timestamp(),
+  `cl_type` enum('page','subcat','file') NOT NULL DEFAULT 'page',
+  `cl_collation_id` smallint(5) unsigned NOT NULL DEFAULT 0,
+  `cl_target_id` bigint(20) unsigned NOT NULL,
+  PRIMARY KEY (`cl_from`,`cl_target_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `categorylinks` VALUES (1,'APPLE','','2024-01-01 00:00:00','page',1,100),(2,'BANANA (FRUIT)','','2024-01-01 00:00:00','page',1,100),(3,'CHERRY, SWEET','','2024-01-01 00:00:00','page',1,100),(4,'DURIAN\'S SMELL','','2024-01-01 00:00:00','page',1,101),(5,'OLD APPLE','','2024-01-01 00:00:00','page',1,100),(11,'TROPICAL FRUITS','','2024-01-01 00:00:00','subcat',1,100),(12,'SOMEONE','','2024-01-01 00:00:00','file',1,100);
@@ -0,0 +1,11 @@
+-- Synthetic categorylinks dump in the older format, naming the category.
+DROP TABLE IF EXISTS `categorylinks`;
+CREATE TABLE `categorylinks` (
+  `cl_from` int(8) unsigned NOT NULL DEFAULT 0,
+  `cl_to` varbinary(255) NOT NULL DEFAULT '',
+  `cl_sortkey` varbinary(230) NOT NULL DEFAULT '',
+  `cl_timestamp` timestamp NOT NULL DEFAULT current_timestamp(),
+  `cl_type` enum('page','subcat','file') NOT NULL DEFAULT 'page',
+  PRIMARY KEY (`cl_from`,`cl_to`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `categorylinks` VALUES (1,'Fruits','APPLE','2024-01-01 00:00:00','page'),(2,'Fruits','BANANA (FRUIT)','2024-01-01 00:00:00','page'),(4,'Tropical_fruits','DURIAN\'S SMELL','2024-01-01 00:00:00','page'),(11,'Fruits','TROPICAL FRUITS','2024-01-01 00:00:00','subcat');
@@ -0,0 +1,9 @@
+-- Synthetic linktarget dump in the format of enwiki-*-linktarget.sql.
+DROP TABLE IF EXISTS `linktarget`;
+CREATE TABLE `linktarget` (
+  `lt_id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `lt_namespace` int(11) NOT NULL,
+  `lt_title` varbinary(255) NOT NULL,
+  PRIMARY KEY (`lt_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `linktarget` VALUES (100,14,'Fruits'),(101,14,'Tropical_fruits'),(102,0,'Apple');
@@ -0,0 +1,15 @@
+-- Synthetic page dump in the format of enwiki-*-page.sql.
+DROP TABLE IF EXISTS `page`;
+CREATE TABLE `page` (
+  `page_id` int(8) unsigned NOT NULL AUTO_INCREMENT,
+  `page_namespace` int(11) NOT NULL DEFAULT 0,
+  `page_title` varbinary(255) NOT NULL DEFAULT '',
+  `page_is_redirect` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_is_new` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_random` double unsigned NOT NULL DEFAULT 0,
+  `page_len` int(8) unsigned NOT NULL DEFAULT 0,
+  PRIMARY KEY (`page_id`),
+  KEY `page_len` (`page_len`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `page` VALUES (1,0,'Apple',0,0,0.1,100),(2,0,'Banana_(fruit)',0,0,0.2,200),(3,0,'Cherry,_sweet',0,0,0.3,300),(4,0,'Durian\'s_smell',0,0,0.4,400),(5,0,'Old_apple',1,0,0.5,10);
+INSERT INTO `page` VALUES (10,14,'Fruits',0,0,0.6,50),(11,14,'Tropical_fruits',0,0,0.7,50),(12,2,'Someone',0,0,0.8,5);
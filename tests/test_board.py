@@ -0,0 +1,88 @@
+import random
+
+import board
+import db
+
+
+def test_pool_draws_every_position_once(monkeypatch):
+    monkeypatch.setattr(db, "category_page_id_at", lambda name, index: (name, index))
+
+    pool = board._Pool(
+        1.0,
+        [("category", "A", 3), ("article", 42, 1), ("category", "B", 2)],
+    )
+    drawn = []
+
+    while not pool.exhausted():
+        drawn.append(pool.draw())
+
+    assert sorted(drawn, key=str) == sorted(
+        [("A", 0), ("A", 1), ("A", 2), 42, ("B", 0), ("B", 1)], key=str
+    )
+
+
+def test_draw_follows_entry_weights(monkeypatch):
+    monkeypatch.setattr(db, "category_page_id_at", lambda name, index: (name, index))
+    monkeypatch.setattr(db, "page_titles", lambda page_ids: page_ids)
+    random.seed(1)
+
+    counts = {"heavy": 0, "light": 0}
+
+    for _ in range(200):
+        pools = [
+            board._Pool(3.0, [("category", "heavy", 1000)]),
+            board._Pool(1.0, [("category", "light", 1000)]),
+        ]
+
+        for (name, _) in board._draw(pools, board.BOARD_SIZE):
+            counts[name] += 1
+
+    share = counts["heavy"] / (counts["heavy"] + counts["light"])
+
+    assert 0.72 < share < 0.78
+
+
+def test_draw_comes_back_short_when_pages_run_out(monkeypatch):
+    monkeypatch.setattr(db, "category_page_id_at", lambda name, index: (name, index))
+    monkeypatch.setattr(db, "page_titles", lambda page_ids: page_ids)
+
+    pools = [board._Pool(1.0, [("category", "A", 3)]), board._Pool(5.0, [("article", 7, 1)])]
+
+    assert sorted(board._draw(pools, board.BOARD_SIZE), key=str) == sorted(
+        [("A", 0), ("A", 1), ("A", 2), 7], key=str
+    )
+
+
+def test_unknown_preset_takes_no_pool_slot(temp_db, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(board, "_pools", board.OrderedDict())
+
+    assert asyncio.run(board.take_board("nope")) is None
+    assert list(board._pools) == []
+
+
+def test_start_game_with_unknown_preset(temp_db, monkeypatch):
+    import asyncio
+
+    import main
+
+    class Context:
+        author = channel = None
+
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, content=None):
+            self.sent.append(content)
+
+    def no_queue(*args, **kwargs):
+        raise AssertionError("unknown presets shouldn't be queued")
+
+    monkeypatch.setattr(main.game_queue, "submit", no_queue)
+    ctx = Context()
+
+    asyncio.run(main.start_game(ctx, "TODO", "nope"))
+
+    assert "does not exist" in ctx.sent[0]
+    assert temp_db.most_used_presets(10) == []
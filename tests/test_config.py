@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    # Points config at a file of its own; the settings are restored afterwards.
+    path = tmp_path / "config.json"
+
+    monkeypatch.setattr(config, "_CONFIG_PATH", str(path))
+    monkeypatch.setattr(config, "_settings", config.Settings())
+    monkeypatch.setattr(config, "_raw", {})
+    monkeypatch.setattr(config, "_mtime", None)
+
+    return path
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [(True, True), (False, False), ("false", False), ("Off", False), ("yes", True), (0, False), (1, True)],
+)
+def test_bools_parse_explicitly(raw, expected):
+    assert config._parse({"profile_commands": raw}).profile_commands is expected
+
+
+@pytest.mark.parametrize("raw", ["maybe", 2, None])
+def test_bad_bool_is_rejected(raw):
+    with pytest.raises(ValueError):
+        config._parse({"profile_commands": raw})
+
+
+def test_reload_reports_changed_fields(config_file):
+    config_file.write_text(json.dumps({"client_token": "a", "game_workers": 2}))
+    assert config.reload(force=True) == ["client_token"]
+
+    config_file.write_text(json.dumps({"client_token": "b", "game_workers": 3}))
+    changed = config.reload(force=True)
+
+    assert changed == ["client_token", "game_workers"]
+    assert [name for name in changed if name in config.RESTART_REQUIRED] == ["client_token"]
+    assert config.reload(force=True) == []
+
+
+def test_broken_reload_keeps_settings(config_file):
+    config_file.write_text(json.dumps({"profile_commands": True}))
+    config.reload(force=True)
+
+    config_file.write_text(json.dumps({"profile_commands": "sometimes"}))
+    assert config.reload(force=True) == []
+    assert config.profile_commands() is True
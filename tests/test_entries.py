@@ -0,0 +1,83 @@
+import asyncio
+
+import http_client
+import wiki
+
+
+class FakeApi:
+    # Answers title lookups the way the MediaWiki API does: "Celeste"
+    # redirects to the game, "indie games" normalizes to "Indie games".
+
+    def __init__(self, monkeypatch):
+        self.requests = 0
+        monkeypatch.setattr(http_client, "get_json", self.get_json)
+
+    @staticmethod
+    def _normalize(title: str) -> str:
+        # First letter after the namespace prefix capitalized.
+        (prefix, _, name) = title.rpartition(":")
+        return (prefix + ":" if prefix else "") + name[0].upper() + name[1:]
+
+    async def get_json(self, url, params=None, **kwargs):
+        self.requests += 1
+        titles = params["titles"].split("|")
+
+        normalized = [
+            {"from": title, "to": self._normalize(title)}
+            for title in titles
+            if self._normalize(title) != title
+        ]
+        redirects = [{"from": "Celeste", "to": "Celeste (video game)"}] if "Celeste" in titles else []
+
+        pages = [
+            {"title": "Celeste (video game)", "pageid": 1},
+            {"title": "Category:Indie games", "categoryinfo": {"size": 10, "pages": 10, "subcats": 0}},
+        ]
+        resolved = {n["from"]: n["to"] for n in normalized}
+        pages.extend(
+            {"title": resolved.get(title, title), "missing": True}
+            for title in titles
+            if resolved.get(title, title) not in ("Celeste", "Celeste (video game)", "Category:Indie games")
+        )
+
+        return {
+            "query": {"normalized": normalized, "redirects": redirects, "pages": pages}
+        }
+
+
+def test_presets_store_resolved_titles(temp_db, monkeypatch):
+    FakeApi(monkeypatch)
+
+    (ok, reason) = asyncio.run(temp_db.create_preset("Indie", ["Celeste", "indie games"]))
+
+    assert ok, reason
+    assert [entry["entry_name"] for entry in temp_db.preset_contents("Indie")] == [
+        "Celeste (video game)",
+        "Indie games",
+    ]
+    assert temp_db.preset_categories("Indie") == ["Indie games"]
+    assert "Celeste (video game)" in temp_db.page_ids(["Celeste (video game)"])
+
+    # Names as typed still address the stored entries.
+    assert temp_db.set_entry_weight("Indie", "Celeste", 2.0) == (True, "")
+    assert temp_db.remove_from_preset("Indie", ["indie games"]) == (True, "")
+    assert temp_db.preset_categories("Indie") == []
+
+
+def test_redirect_is_looked_up_once(temp_db, monkeypatch):
+    api = FakeApi(monkeypatch)
+
+    assert asyncio.run(wiki.resolve_entries(["Celeste"])) == {
+        "Celeste": ("article", "Celeste (video game)")
+    }
+    assert api.requests == 1
+
+    # Served from EntryLookups, target included.
+    assert asyncio.run(wiki.resolve_entries(["Celeste"])) == {
+        "Celeste": ("article", "Celeste (video game)")
+    }
+    (ok, reason) = asyncio.run(temp_db.create_preset("Game", ["Celeste"]))
+
+    assert ok, reason
+    assert api.requests == 1
+    assert temp_db.known_entries(["Celeste", "Celeste (video game)"]) == {"Celeste (video game)"}
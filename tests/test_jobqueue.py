@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+
+import jobqueue
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_runs_jobs_and_returns_results():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=2, max_depth=5)
+
+        async def job(value):
+            await asyncio.sleep(0)
+            return value * 2
+
+        futures = [queue.submit([i], lambda i=i: job(i))[0] for i in range(4)]
+
+        return await asyncio.gather(*futures)
+
+    assert run(go()) == [0, 2, 4, 6]
+
+
+def test_positions_count_waiting_jobs():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=5)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        positions = [queue.submit([i], job)[1] for i in range(3)]
+        await asyncio.sleep(0)
+
+        # The first job is running now, so the third moved up one.
+        (_, position, _) = queue.submit([2], job)
+        release.set()
+
+        return (positions, position)
+
+    assert run(go()) == ([0, 2, 3], 2)
+
+
+def test_duplicate_keys_join_the_existing_job():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=5)
+        calls = []
+        release = asyncio.Event()
+
+        async def job():
+            calls.append(1)
+            await release.wait()
+            return "room"
+
+        (first, _, first_joined) = queue.submit([("user", 1), ("channel", 1)], job)
+        # Any one shared key is enough.
+        (second, _, second_joined) = queue.submit([("user", 2), ("channel", 1)], job)
+
+        release.set()
+        results = await asyncio.gather(first, second)
+
+        # Once the job is done its keys are free again.
+        (third, _, third_joined) = queue.submit([("channel", 1)], job)
+        results.append(await third)
+
+        return (calls, results, first_joined, second_joined, third_joined, second is first)
+
+    (calls, results, first_joined, second_joined, third_joined, same) = run(go())
+
+    assert calls == [1, 1]
+    assert results == ["room", "room", "room"]
+    assert (first_joined, second_joined, third_joined) == (False, True, False)
+    assert same
+
+
+def test_full_queue_rejects_without_waiting():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=2)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        queue.submit([0], job)
+        await asyncio.sleep(0)
+        queue.submit([1], job)
+        queue.submit([2], job)
+
+        with pytest.raises(jobqueue.QueueFull):
+            queue.submit([3], job)
+
+        release.set()
+
+    run(go())
+
+
+def test_failing_job_sets_exception_and_worker_survives():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=5)
+
+        async def broken():
+            raise ValueError("no board")
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def fine():
+            return "ok"
+
+        (failed, _, _) = queue.submit([0], broken)
+        (gone, _, _) = queue.submit([1], cancelled)
+        (ok, _, _) = queue.submit([2], fine)
+
+        with pytest.raises(ValueError):
+            await failed
+
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+
+        return await ok
+
+    assert run(go()) == "ok"
+
+
+def test_cancelled_submitter_does_not_kill_the_worker():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=5)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+            return "room"
+
+        async def submitter(key):
+            (future, _, _) = queue.submit([key], job)
+            return await future
+
+        # The submitter's own await cancels the future with it.
+        waiting = asyncio.create_task(submitter(0))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        (future, _, _) = queue.submit([1], job)
+
+        return await future
+
+    assert run(go()) == "room"
+
+
+def test_resize_changes_workers_and_depth():
+    async def go():
+        queue = jobqueue.JobQueue("test", workers=1, max_depth=1)
+        release = asyncio.Event()
+        running = 0
+        peak = 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await release.wait()
+            running -= 1
+
+        queue.resize(workers=3, max_depth=5)
+        futures = [queue.submit([i], job)[0] for i in range(4)]
+        await asyncio.sleep(0.01)
+        assert peak == 3
+
+        release.set()
+        await asyncio.gather(*futures)
+
+        # Surplus workers stop once they've finished a job.
+        queue.resize(workers=1, max_depth=5)
+        await asyncio.gather(*[queue.submit([i], job)[0] for i in range(4)])
+        await asyncio.sleep(0)
+        assert len([task for task in queue._tasks if not task.done()]) == 1
+
+    run(go())
@@ -0,0 +1,66 @@
+from array import array
+
+import lru
+
+
+def test_evicts_least_recently_used_by_entries():
+    cache = lru.LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_accounting():
+    cache = lru.LRUCache(max_entries=100, max_bytes=300, size_fn=len)
+    cache.put("a", "x" * 100)
+    cache.put("b", "x" * 100)
+    # Replacing a value swaps its size rather than adding to it.
+    cache.put("a", "x" * 50)
+
+    assert cache.total_bytes == 150
+
+    cache.put("c", "x" * 200)
+
+    # "b" was least recently used, and dropping it alone is enough.
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.total_bytes == 250
+
+    cache.invalidate("c")
+    assert cache.total_bytes == 50
+
+    cache.clear()
+    assert cache.total_bytes == 0
+
+
+def test_value_larger_than_budget_is_not_cached():
+    cache = lru.LRUCache(max_entries=100, max_bytes=10, size_fn=len)
+    cache.put("a", "x" * 5)
+    cache.put("b", "x" * 11)
+
+    assert "b" not in cache and "a" in cache
+    assert cache.total_bytes == 5
+
+
+def test_approx_size_of_id_arrays():
+    ids = array("I", range(1000))
+
+    assert lru.approx_size(ids) == 64 + 1000 * ids.itemsize
+
+
+def test_resize_evicts_and_starts_measuring():
+    cache = lru.LRUCache(max_entries=3, size_fn=len)
+    cache.put("a", "x" * 100)
+    cache.put("b", "x" * 100)
+    cache.put("c", "x" * 100)
+
+    # Without a byte limit nothing was measured; turning one on measures.
+    cache.resize(max_entries=3, max_bytes=250)
+    assert "a" not in cache and "b" in cache and "c" in cache
+    assert cache.total_bytes == 200
+
+    cache.resize(max_entries=1)
+    assert "c" in cache and len(cache._entries) == 1
@@ -0,0 +1,29 @@
+import time
+
+import db
+import metrics
+
+
+def test_fetch_all_timing_includes_reading_rows(temp_db, monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+
+    conn = temp_db.connection()
+    conn.create_function("slow", 1, lambda value: time.sleep(0.01) or value)
+    conn.execute("CREATE TEMP TABLE Numbers(n INTEGER)")
+    conn.executemany("INSERT INTO Numbers(n) VALUES(?)", [(n,) for n in range(5)])
+
+    # execute() only steps to the first row; fetch_all() times reading the rest.
+    rows = [row[0] for row in conn.fetch_all("SELECT slow(n) FROM Numbers")]
+
+    histogram = metrics.histograms("sqlite_query_seconds")[(("query", "SELECT Numbers"),)]
+
+    assert rows == [0, 1, 2, 3, 4]
+    assert histogram.count == 1
+    assert histogram.sum >= 0.05
+
+
+def test_prometheus_output_has_help_lines(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    metrics.observe("sqlite_query_seconds", 0.001, query="SELECT Pages")
+
+    assert "# HELP sqlite_query_seconds " in metrics.render_prometheus()
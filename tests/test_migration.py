@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+import db
+
+
+def make_baseline_db(path: str):
+    # The schema and data layout of the original release: presets as JSON
+    # entry lists, PresetEntries without a key, page lists as JSON titles.
+    conn = sqlite3.connect(path)
+
+    with conn:
+        conn.execute(
+            "CREATE TABLE Presets("
+            "preset_name TEXT PRIMARY KEY, "
+            "entries JSON DEFAULT('[]'), "
+            "description TEXT"
+            ")"
+        )
+        conn.execute(
+            "CREATE TABLE PresetEntries("
+            "entry_name TEXT PRIMARY_KEY, "
+            "entry_type TEXT CHECK( entry_type in ('category', 'article') )"
+            ")"
+        )
+        conn.execute(
+            "CREATE TABLE CategoryCache("
+            "category_name TEXT PRIMARY KEY, "
+            "pages JSON DEFAULT('[]')"
+            ")"
+        )
+
+        conn.executemany(
+            "INSERT INTO PresetEntries VALUES(?, ?)",
+            [
+                ("Indie games", "category"),
+                ("Celeste (video game)", "article"),
+                ("Celeste (video game)", "article"),
+            ],
+        )
+        conn.execute(
+            "INSERT INTO Presets VALUES(?, ?, ?)",
+            ("Indie", json.dumps(["Indie games", "Celeste (video game)"]), "Indie games."),
+        )
+        conn.execute(
+            "INSERT INTO CategoryCache VALUES(?, ?)",
+            ("Indie games", json.dumps(["Celeste (video game)", "Hades (video game)"])),
+        )
+
+    conn.close()
+
+
+def test_migrates_baseline_database(db_path):
+    make_baseline_db(db_path)
+
+    db.migrate_db()
+    # Running it again changes nothing.
+    db.migrate_db()
+
+    assert db.preset_categories("Indie") == ["Indie games"]
+    assert sorted(entry["entry_name"] for entry in db.preset_contents("Indie")) == [
+        "Celeste (video game)",
+        "Indie games",
+    ]
+    assert db.known_entries(["Indie games", "Nope"]) == {"Indie games"}
+
+    assert db.category_cache("Indie games") == ["Celeste (video game)", "Hades (video game)"]
+    assert db.page_titles(list(db.category_page_ids("Indie games"))) == [
+        "Celeste (video game)",
+        "Hades (video game)",
+    ]
+    # Article entries are interned, so boards can read their ids.
+    assert "Celeste (video game)" in db.page_ids(["Celeste (video game)"])
+
+    conn = db.connection()
+    assert conn.execute("SELECT entries FROM Presets").fetchall() == [("[]",)]
+    assert conn.execute("SELECT COUNT(*) FROM PresetEntries").fetchone() == (2,)
+
+
+def test_failed_migration_leaves_schema_untouched(db_path, monkeypatch):
+    make_baseline_db(db_path)
+
+    def broken(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db, "_intern_titles", broken)
+
+    with pytest.raises(sqlite3.OperationalError):
+        db.migrate_db()
+
+    conn = db.connection()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    preset_columns = [row[1] for row in conn.execute("PRAGMA table_info(Presets)")]
+
+    assert tables == {"Presets", "PresetEntries", "CategoryCache"}
+    assert preset_columns == ["preset_name", "entries", "description"]
+    assert conn.execute("SELECT entries FROM Presets").fetchone()[0] != "[]"
+
+
+def test_preset_articles_are_interned_on_write(temp_db):
+    temp_db.create_entries(
+        [("Celeste (video game)", "article"), ("Indie games", "category")]
+    )
+
+    (ok, _) = asyncio.run(
+        temp_db.create_preset("Indie", ["Celeste (video game)", "Indie games"])
+    )
+
+    assert ok
+    # Only the article; category names aren't pages.
+    assert list(temp_db.page_ids(["Celeste (video game)", "Indie games"])) == [
+        "Celeste (video game)"
+    ]
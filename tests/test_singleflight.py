@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import singleflight
+
+
+def test_do_shares_one_call():
+    async def go():
+        flight = singleflight.SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "pages"
+
+        results = await asyncio.gather(*[flight.do("Cat", fetch) for _ in range(5)])
+
+        return (calls, results, flight.in_flight("Cat"))
+
+    assert asyncio.run(go()) == ([1], ["pages"] * 5, False)
+
+
+def test_do_shares_failures():
+    async def go():
+        flight = singleflight.SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("api down")
+
+        return await asyncio.gather(
+            flight.do("Cat", fetch), flight.do("Cat", fetch), return_exceptions=True
+        )
+
+    results = asyncio.run(go())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_do_many_only_fetches_keys_not_in_flight():
+    async def go():
+        flight = singleflight.SingleFlight()
+        batches = []
+        release = asyncio.Event()
+
+        async def fetch(keys):
+            batches.append(sorted(keys))
+            await release.wait()
+            return {key: key.upper() for key in keys}
+
+        first = asyncio.create_task(flight.do_many(["a", "b"], fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flight.do_many(["b", "c", "c"], fetch))
+        await asyncio.sleep(0)
+        release.set()
+
+        return (batches, await first, await second)
+
+    (batches, first, second) = asyncio.run(go())
+
+    assert batches == [["a", "b"], ["c"]]
+    assert first == {"a": "A", "b": "B"}
+    assert second == {"b": "B", "c": "C"}
+
+
+def test_do_many_failure_reaches_waiters():
+    async def go():
+        flight = singleflight.SingleFlight()
+
+        async def fetch(keys):
+            await asyncio.sleep(0.01)
+            raise ValueError("api down")
+
+        first = asyncio.create_task(flight.do_many(["a"], fetch))
+        await asyncio.sleep(0)
+
+        with pytest.raises(ValueError):
+            await flight.do_many(["a"], fetch)
+
+        with pytest.raises(ValueError):
+            await first
+
+        return flight.in_flight("a")
+
+    assert asyncio.run(go()) is False
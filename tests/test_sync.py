@@ -0,0 +1,97 @@
+import asyncio
+
+import config
+import wiki
+
+
+class FakeCategory:
+    # Stands in for the API calls behind fetch_category and sync_category.
+
+    def __init__(self, monkeypatch, members, newest):
+        self.members = list(members)
+        self.newest = newest
+        self.listings = []
+
+        monkeypatch.setattr(wiki, "_category_state", self.state)
+        monkeypatch.setattr(wiki, "_iter_category_members", self.iter_members)
+
+    async def state(self, category_name):
+        return (len(self.members), 0, self.newest)
+
+    async def iter_members(self, category_name, extra_params=None):
+        start = (extra_params or {}).get("gcmstart")
+        self.listings.append(start)
+
+        members = [title for title, added in self.members if start is None or added > start]
+        yield (members, [wiki.page_flags(title, False) for title in members], [])
+
+
+def test_incremental_sync(temp_db, monkeypatch):
+    fake = FakeCategory(monkeypatch, [("A", "t1"), ("B", "t1"), ("List of C", "t1")], "t1")
+
+    assert asyncio.run(wiki.fetch_category("Cat"))
+    assert fake.listings == [None]
+
+    # Nothing new: only the state request.
+    assert asyncio.run(wiki.sync_category("Cat"))
+    assert fake.listings == [None]
+
+    # Only members added since the high-water mark are listed.
+    fake.members.append(("D", "t2"))
+    fake.newest = "t2"
+
+    assert asyncio.run(wiki.sync_category("Cat"))
+    assert fake.listings == [None, "t1"]
+    assert sorted(temp_db.category_cache("Cat")) == ["A", "B", "D"]
+    assert temp_db.category_usable_count("Cat") == 3
+    assert len(temp_db.category_page_ids("Cat")) == 4
+
+    # A removal shows up as a count mismatch and forces a full fetch.
+    fake.members = [member for member in fake.members if member[0] != "B"]
+
+    assert asyncio.run(wiki.sync_category("Cat"))
+    assert fake.listings == [None, "t1", None]
+    assert sorted(temp_db.category_cache("Cat")) == ["A", "D"]
+
+
+def test_incremental_sync_with_member_cap(temp_db, monkeypatch):
+    monkeypatch.setattr(config, "_settings", config.settings())
+    config.override(category_max_members=3)
+
+    fake = FakeCategory(
+        monkeypatch, [("A", "t1"), ("B", "t1"), ("C", "t1"), ("D", "t1")], "t1"
+    )
+
+    assert asyncio.run(wiki.fetch_category("Cat"))
+    assert len(temp_db.category_page_ids("Cat")) == 3
+
+    fake.members.append(("E", "t2"))
+    fake.newest = "t2"
+
+    # Still incremental, and the cap still holds.
+    assert asyncio.run(wiki.sync_category("Cat"))
+    assert fake.listings == [None, "t1"]
+    assert len(temp_db.category_page_ids("Cat")) == 3
+
+
+def test_failed_refresh_backs_off(temp_db, monkeypatch):
+    attempts = []
+
+    async def failing_sync(category_name):
+        attempts.append(category_name)
+        return False
+
+    monkeypatch.setattr(wiki, "sync_category", failing_sync)
+    monkeypatch.setattr(wiki, "_refresh_failures", {})
+
+    async def go():
+        wiki.schedule_refresh("Cat")
+        await asyncio.gather(*wiki._background_tasks)
+
+        # Within the cooldown, stale hits don't retry.
+        wiki.schedule_refresh("Cat")
+        await asyncio.gather(*wiki._background_tasks)
+
+    asyncio.run(go())
+
+    assert attempts == ["Cat"]
@@ -0,0 +1,95 @@
+import asyncio
+import os
+
+import pytest
+
+import wikidump
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(name: str) -> str:
+    return os.path.join(FIXTURES, name)
+
+
+def test_parse_values_handles_quoted_punctuation():
+    statement = (
+        "INSERT INTO `page` VALUES (1,0,'Banana_(fruit)',NULL),"
+        "(2,0,'Cherry,_sweet),(x',0),(3,0,'Durian\\'s_smell\\\\',1);"
+    )
+
+    assert list(wikidump.parse_values(statement)) == [
+        ["1", "0", "Banana_(fruit)", None],
+        ["2", "0", "Cherry,_sweet),(x", "0"],
+        ["3", "0", "Durian's_smell\\", "1"],
+    ]
+
+
+def test_iter_dump_rows_maps_columns():
+    rows = list(wikidump.iter_dump_rows(fixture("linktarget.sql")))
+
+    assert rows[0] == {"lt_id": "100", "lt_namespace": "14", "lt_title": "Fruits"}
+    assert len(rows) == 3
+
+
+def test_import_with_linktargets(temp_db):
+    assert wikidump.import_linktargets(fixture("linktarget.sql")) == 2
+    # The user talk page is skipped.
+    assert wikidump.import_pages(fixture("page.sql")) == 7
+    # The file link is skipped.
+    assert wikidump.import_categorylinks(fixture("categorylinks.sql")) == 6
+    temp_db.dump_index_changed()
+
+    conn = temp_db.connection()
+    pages = dict(conn.execute("SELECT page_id, title FROM DumpPages").fetchall())
+    links = sorted(conn.execute("SELECT cl_to, cl_type, cl_from FROM DumpCategoryLinks").fetchall())
+
+    assert pages[2] == "Banana (fruit)"
+    assert pages[4] == "Durian's smell"
+    assert links == [
+        ("Fruits", "page", 1),
+        ("Fruits", "page", 2),
+        ("Fruits", "page", 3),
+        ("Fruits", "page", 5),
+        ("Fruits", "subcat", 11),
+        ("Tropical fruits", "page", 4),
+    ]
+
+    assert temp_db.dump_entry_types(["Fruits", "Apple", "Nope"]) == {
+        "Fruits": "category",
+        "Apple": "article",
+    }
+
+
+def test_category_contents_served_from_dump(temp_db, monkeypatch):
+    import wiki
+
+    async def no_api(*args, **kwargs):
+        raise AssertionError("the API shouldn't be asked")
+
+    monkeypatch.setattr(wiki, "_category_state", no_api)
+
+    wikidump.import_linktargets(fixture("linktarget.sql"))
+    wikidump.import_pages(fixture("page.sql"))
+    wikidump.import_categorylinks(fixture("categorylinks.sql"))
+    temp_db.dump_index_changed()
+
+    (pages, subcats) = asyncio.run(wiki.category_members("Fruits", 0))
+
+    # The redirect is left out.
+    assert sorted(pages) == ["Apple", "Banana (fruit)", "Cherry, sweet"]
+    assert subcats == ["Tropical fruits"]
+    assert len(temp_db.category_page_ids("Fruits")) == 4
+
+
+def test_import_with_cl_to(temp_db):
+    wikidump.import_pages(fixture("page.sql"))
+
+    assert wikidump.import_categorylinks(fixture("categorylinks_cl_to.sql")) == 4
+
+
+def test_cl_target_id_without_linktargets_fails(temp_db):
+    wikidump.import_pages(fixture("page.sql"))
+
+    with pytest.raises(wikidump.DumpImportError):
+        wikidump.import_categorylinks(fixture("categorylinks.sql"))
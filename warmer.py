@@ -0,0 +1,106 @@
+import asyncio
+
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import config
+import db
+import wiki
+
+# Background warm-ups by preset name. Presets written to while their warm-up
+# is running get warmed again once it finishes, to pick up new categories.
+_jobs: Dict[str, asyncio.Task] = {}
+_pending = set()
+_background_limiter = None
+
+
+def _background_slot() -> asyncio.Semaphore:
+    # Background warm-ups run one preset at a time, with at most
+    # `warm_concurrency` category fetches in flight, so interactive commands
+    # keep most of the HTTP pool to themselves. `!wiki preset warm` doesn't
+    # queue behind them; categories both are fetching are shared anyway.
+    global _background_limiter
+
+    if _background_limiter is None:
+        _background_limiter = asyncio.Semaphore(1)
+
+    return _background_limiter
+
+
+async def _warm_categories(
+    categories: List[str],
+    on_progress: Callable[[int, int, str], Awaitable[None]] = None,
+) -> int:
+    warmed = 0
+
+    for done, category_name in enumerate(categories, 1):
+        tree = await wiki.crawl_category_tree(
+            category_name,
+            config.category_depth(),
+            concurrency=config.warm_concurrency(),
+        )
+
+        if len(tree) > 0:
+            warmed += 1
+
+        if on_progress is not None:
+            await on_progress(done, len(categories), category_name)
+
+    return warmed
+
+
+async def warm_preset(
+    preset_name: str,
+    on_progress: Callable[[int, int, str], Awaitable[None]] = None,
+    background: bool = False,
+) -> Tuple[int, int]:
+    # Fetches every category tree in the preset into the cache, calling
+    # on_progress(done, total, category_name) after each one. Returns how many
+    # of the preset's categories could be cached, out of how many.
+    if not background:
+        categories = db.preset_categories(preset_name)
+        return (await _warm_categories(categories, on_progress), len(categories))
+
+    async with _background_slot():
+        # Read once it's our turn, to pick up categories added meanwhile.
+        categories = db.preset_categories(preset_name)
+        return (await _warm_categories(categories, on_progress), len(categories))
+
+
+async def _warm_in_background(preset_name: str):
+    try:
+        (warmed, total) = await warm_preset(preset_name, background=True)
+    except Exception as err:
+        print(f"warm_preset: warming {preset_name} failed: {err!r}")
+        return
+
+    print(f"Warmed {warmed}/{total} categories of preset {preset_name}")
+
+
+def schedule_warm(preset_name: str):
+    if preset_name in _jobs:
+        _pending.add(preset_name)
+        return
+
+    task = asyncio.create_task(_warm_in_background(preset_name))
+    task.add_done_callback(lambda done: _warm_done(preset_name, done))
+    _jobs[preset_name] = task
+
+
+def _warm_done(preset_name: str, task: asyncio.Task):
+    if _jobs.get(preset_name) is task:
+        del _jobs[preset_name]
+
+    if preset_name in _pending and not task.cancelled():
+        _pending.discard(preset_name)
+        schedule_warm(preset_name)
+
+
+def warm_most_used():
+    for preset_name in db.most_used_presets(config.warm_presets_on_start()):
+        schedule_warm(preset_name)
+
+
+def warm_stats() -> Dict[str, int]:
+    # Background warm-ups scheduled (running or waiting their turn), and
+    # presets due another once theirs finishes.
+    return {"scheduled": len(_jobs), "pending": len(_pending)}
@@ -1,7 +1,12 @@
-import requests
+import asyncio
+import config
+import time
+import http_client
+import metrics
+import singleflight
 from json import loads, dumps
 
-from typing import List
+from typing import List, Dict, Tuple
 
 import urllib
 
@@ -10,92 +15,541 @@ def urlFormat(s):
     return urllib.parse.quote(s.encode("utf-8"))
 
 
-def category_contents(category_name: str, n: int = 10) -> List[str]:
+# Concurrent fetches of the same category, or lookups of the same title,
+# share a single request.
+_category_fetches = singleflight.SingleFlight()
+_entry_lookups = singleflight.SingleFlight()
+
+metrics.describe("category_cache_lookups_total", "Category cache lookups, by hit, stale or miss.")
+
+# Background refresh tasks, kept referenced until they finish.
+_background_tasks = set()
+
+# When each category's last refresh failed, cleared once one succeeds.
+_refresh_failures: Dict[str, float] = {}
+
+
+async def category_contents(category_name: str, max_members: int = None) -> List[str]:
+    (pages, _) = await category_members(category_name, max_members)
+
+    return pages
+
+
+async def category_members(
+    category_name: str, max_members: int = None
+) -> Tuple[List[str], List[str]]:
     import db
 
+    subcats = await category_subcats(category_name, max_members)
+
+    if subcats is None:
+        return ([], [])
+
+    return (db.category_cache(category_name), subcats)
+
+
+async def category_subcats(
+    category_name: str, max_members: int = None
+) -> List[str] | None:
+    # Makes sure the category is cached without loading its page list.
+    import db
+
+    # Stale-while-revalidate: a cached copy is always served immediately, and
+    # an expired one additionally schedules a refresh in the background.
     if db.category_cache_exists(category_name):
-        return db.category_cache(category_name)
+        if db.category_cache_expired(category_name):
+            metrics.inc("category_cache_lookups_total", result="stale")
+            schedule_refresh(category_name)
+        else:
+            metrics.inc("category_cache_lookups_total", result="hit")
+    else:
+        metrics.inc("category_cache_lookups_total", result="miss")
+
+        if not await _category_fetches.do(
+            category_name, lambda: fetch_category(category_name, max_members)
+        ):
+            return None
+
+    return db.category_cache_subcats(category_name)
+
+
+async def crawl_category_tree(
+    category_name: str, depth: int = 0, max_pages: int = None, concurrency: int = None
+) -> List[str]:
+    # Breadth-first walk down to `depth` levels of subcategories, returning the
+    # names of every cached category reached. Each level's categories are
+    # fetched concurrently (bounded), and every category visited lands in
+    # CategoryCache on its own, so overlapping subtrees are shared.
+    import db
+
+    if max_pages is None:
+        max_pages = config.crawl_max_pages()
+
+    if concurrency is None:
+        concurrency = config.crawl_concurrency()
+
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def subcats_of(name):
+        async with limiter:
+            return await category_subcats(name)
+
+    seen_categories = {category_name}
+    frontier = [category_name]
+    categories = []
+    page_total = 0
+
+    for level in range(depth + 1):
+        results = await asyncio.gather(*[subcats_of(name) for name in frontier])
+
+        next_frontier = []
+
+        for name, subcats in zip(frontier, results):
+            if subcats is None:
+                continue
+
+            categories.append(name)
+            page_total += db.category_page_count(name)
+
+            for subcat in subcats:
+                if subcat not in seen_categories:
+                    seen_categories.add(subcat)
+                    next_frontier.append(subcat)
+
+        if page_total >= max_pages or level == depth:
+            break
+
+        frontier = next_frontier
+
+        if len(frontier) == 0:
+            break
+
+    return categories
+
+
+async def crawl_category(
+    category_name: str, depth: int = 0, max_pages: int = None
+) -> List[str]:
+    # Every page in the category tree, deduplicated across branches.
+    import db
+
+    pages = {}
+
+    for name in await crawl_category_tree(category_name, depth, max_pages):
+        pages.update(dict.fromkeys(db.category_cache(name)))
+
+    return list(pages)
+
+
+def schedule_refresh(category_name: str):
+    if _category_fetches.in_flight(category_name):
+        return
+
+    # Back off from categories whose last refresh failed, rather than trying
+    # again on every stale hit.
+    failed_at = _refresh_failures.get(category_name)
+    if failed_at is not None and time.monotonic() - failed_at < config.category_refresh_cooldown():
+        return
+
+    task = asyncio.create_task(refresh_category(category_name))
+    task.add_done_callback(_background_tasks.discard)
+    _background_tasks.add(task)
+
+
+async def refresh_category(category_name: str) -> bool:
+    refreshed = False
+
+    try:
+        refreshed = await _category_fetches.do(
+            category_name, lambda: sync_category(category_name)
+        )
+    finally:
+        if refreshed:
+            _refresh_failures.pop(category_name, None)
+        else:
+            _refresh_failures[category_name] = time.monotonic()
+
+    return refreshed
+
+
+# "max" is 500 members per request for regular API clients.
+CATEGORY_PAGE_SIZE = "max"
+
+# Titles of pages that are just lists of other pages.
+LIST_PREFIXES = ("List of ", "Lists of ")
+
+
+def page_flags(title: str, is_redirect: bool, is_disambiguation: bool = False) -> int:
+    import db
 
+    flags = 0
+
+    if is_redirect:
+        flags |= db.PAGE_REDIRECT
+    if is_disambiguation:
+        flags |= db.PAGE_DISAMBIGUATION
+    if title.startswith(LIST_PREFIXES):
+        flags |= db.PAGE_LIST
+
+    return flags
+
+
+def _fetch_category_from_dump(category_name: str, max_members: int) -> bool:
+    # The dumps have no page props, so disambiguation pages aren't flagged here.
+    import db
+
+    fetch_id = db.begin_category_fetch(category_name)
+    member_count = 0
+
+    for rows in db.dump_category_pages(category_name):
+        if max_members > 0:
+            rows = rows[: max_members - member_count]
+
+        db.cache_category_batch(
+            category_name,
+            fetch_id,
+            [title for (title, _) in rows],
+            [page_flags(title, is_redirect) for (title, is_redirect) in rows],
+        )
+        member_count += len(rows)
+
+        if max_members > 0 and member_count >= max_members:
+            break
+
+    return db.finish_category_fetch(
+        category_name, fetch_id, db.dump_category_subcats(category_name)
+    )
+
+
+async def _category_state(category_name: str) -> Tuple[int, int, str | None] | None:
+    # One request for the category's (page count, subcategory count, newest
+    # member timestamp), or None if the request failed.
     request_params = {
         "action": "query",
-        "list": "categorymembers",
         "format": "json",
+        "formatversion": "2",
+        "prop": "categoryinfo",
+        "titles": f"Category:{category_name}",
+        "list": "categorymembers",
         "cmtitle": f"Category:{category_name}",
-        "cmlimit": min(n, 100),
-        "cmprop": "title|type",
+        "cmtype": "page|subcat",
+        "cmprop": "timestamp",
+        "cmsort": "timestamp",
+        "cmdir": "descending",
+        "cmlimit": "1",
     }
 
-    pages = []
+    try:
+        js = await http_client.get_json(config.wiki_api_url(), params=request_params)
+    except http_client.HttpError as err:
+        print(f"Wiki API request failed: {err}")
+        return None
 
-    while len(pages) < n:
-        resp = requests.get("https://en.wikipedia.org/w/api.php", params=request_params)
-        js = resp.json()
+    if "query" not in js:
+        print(f"Got unexpected response from wiki API: {js}")
+        return None
 
-        if "query" not in js:
-            print(f"Got unexpected response from wiki API: {resp.content}")
-            return []
-        else:
-            # print(js)
-            pass
+    info = {}
+    for page in js["query"].get("pages", []):
+        info = page.get("categoryinfo", {})
+
+    newest = [member["timestamp"] for member in js["query"]["categorymembers"]]
 
-        pages.extend(js["query"]["categorymembers"])
+    return (
+        info.get("pages", 0),
+        info.get("subcats", 0),
+        newest[0] if len(newest) > 0 else None,
+    )
+
+
+async def _iter_category_members(category_name: str, extra_params: Dict[str, str] = None):
+    # Yields (page titles, page flags, subcategory names) one API response at a
+    # time. Members come from a categorymembers generator so each one's
+    # redirect status and disambiguation page prop arrive in the same request.
+    # Raises HttpError if a request fails or returns something unexpected.
+    request_params = {
+        "action": "query",
+        "format": "json",
+        "formatversion": "2",
+        "generator": "categorymembers",
+        "gcmtitle": f"Category:{category_name}",
+        "gcmlimit": CATEGORY_PAGE_SIZE,
+        "gcmtype": "page|subcat",
+        "prop": "info|pageprops",
+        "ppprop": "disambiguation",
+    }
+    request_params.update(extra_params or {})
+
+    while True:
+        js = await http_client.get_json(config.wiki_api_url(), params=request_params)
+
+        if "query" not in js and "batchcomplete" not in js:
+            raise http_client.HttpError(f"Got unexpected response from wiki API: {js}")
+
+        members = js.get("query", {}).get("pages", [])
+        pages = [page for page in members if page["ns"] != 14]
+
+        yield (
+            [page["title"] for page in pages],
+            [
+                page_flags(
+                    page["title"],
+                    page.get("redirect", False),
+                    "disambiguation" in page.get("pageprops", {}),
+                )
+                for page in pages
+            ],
+            [
+                page["title"].removeprefix("Category:")
+                for page in members
+                if page["ns"] == 14
+            ],
+        )
 
         if "continue" in js:
-            request_params["cmcontinue"] = js["continue"]["cmcontinue"]
-            request_params["cmlimit"] -= 100
+            request_params.update(js["continue"])
         else:
             # we're out of entries, break out
             break
 
-    page_titles = [page["title"] for page in pages if page["type"] == "page"]
 
-    db.cache_category(category_name, page_titles)
+async def fetch_category(category_name: str, max_members: int = None) -> bool:
+    # Serves from the offline dump index when it has the category. Otherwise
+    # walks the whole continuation chain, writing each batch straight into the
+    # cache so only one response is held in memory at a time.
+    import db
 
-    return page_titles
+    if max_members is None:
+        max_members = config.category_max_members()
 
+    if db.dump_has_category(category_name):
+        return await asyncio.to_thread(
+            _fetch_category_from_dump, category_name, max_members
+        )
 
-def entry_type(entry_name: str) -> str:
-    # category check:
-    # https://en.wikipedia.org/w/api.php?action=query&format=json&prop=info&list=allcategories&formatversion=2&acprefix=The%20Game%20Awards%20winners
+    # Taken first, so anything added while we're listing is picked up again
+    # by the next incremental sync.
+    state = await _category_state(category_name)
 
-    # check if it's a category
-    category_check_params = {
-        "action": "query",
-        "format": "json",
-        "prop": "info",
-        "list": "allcategories",
-        "formatversion": "2",
-        "acprefix": entry_name,
-    }
+    if state is None:
+        return False
+
+    fetch_id = db.begin_category_fetch(category_name)
+    subcat_names = []
+    member_count = 0
+
+    try:
+        async for (page_titles, flags, subcats) in _iter_category_members(
+            category_name
+        ):
+            subcat_names.extend(subcats)
 
-    category_check_resp = requests.get(
-        "https://en.wikipedia.org/w/api.php", params=category_check_params
+            if max_members > 0:
+                page_titles = page_titles[: max_members - member_count]
+                flags = flags[: len(page_titles)]
+
+            db.cache_category_batch(category_name, fetch_id, page_titles, flags)
+            member_count += len(page_titles)
+
+            if max_members > 0 and member_count >= max_members:
+                break
+    except http_client.HttpError as err:
+        print(f"Wiki API request failed: {err}")
+        db.abort_category_fetch(category_name, fetch_id)
+        return False
+
+    return db.finish_category_fetch(
+        category_name, fetch_id, subcat_names, synced_at=state[2]
     )
-    category_check_json = category_check_resp.json()
+
+
+async def sync_category(category_name: str) -> bool:
+    # Brings a cached category up to date with as few requests as possible.
+    # One request returns the category's member counts and newest member; if
+    # nothing is newer than the high-water mark and the counts match, that's
+    # it. Otherwise only members added since then are listed, and if the counts
+    # still disagree something was removed, so fall back to a full fetch. With
+    # a member cap, new members only fill the cache up to the cap.
+    import db
+
+    max_members = config.category_max_members()
+    (synced_at, full_synced_at) = db.category_sync_state(category_name)
 
     if (
-        "query" in category_check_json
-        and len(category_check_json["query"]["allcategories"]) > 0
+        synced_at is None
+        or full_synced_at is None
+        or time.time() - full_synced_at > config.category_full_sync_interval()
+        or db.dump_has_category(category_name)
     ):
-        return "category"
+        return await fetch_category(category_name)
+
+    state = await _category_state(category_name)
+
+    if state is None:
+        return False
+
+    (expected_pages, expected_subcats, newest) = state
+
+    page_titles = []
+    flags = []
+    subcat_names = []
+
+    if newest is not None and newest > synced_at:
+        try:
+            async for (batch_titles, batch_flags, subcats) in _iter_category_members(
+                category_name,
+                {"gcmsort": "timestamp", "gcmdir": "ascending", "gcmstart": synced_at},
+            ):
+                page_titles.extend(batch_titles)
+                flags.extend(batch_flags)
+                subcat_names.extend(subcats)
+        except http_client.HttpError as err:
+            print(f"Wiki API request failed: {err}")
+            return False
+
+        synced_at = newest
+
+    (page_count, subcat_count) = db.extend_category(
+        category_name, page_titles, subcat_names, synced_at, flags, max_members=max_members
+    )
+
+    if max_members > 0:
+        expected_pages = min(expected_pages, max_members)
+
+    if (page_count, subcat_count) != (expected_pages, expected_subcats):
+        # Members were removed (or the counts are off); start over.
+        return await fetch_category(category_name)
+
+    return True
+
 
-    # Okay, it's not a category. It may still be an article.
-    article_check_params = {
+# The API accepts at most 50 titles per query, and each name is checked both
+# as "Category:NAME" and as a plain article title.
+MAX_TITLES_PER_QUERY = 50
+
+
+def _chunks(items: List[str], size: int) -> List[List[str]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+async def _resolve_titles(titles: List[str]) -> Dict[str, Tuple[bool, str]]:
+    # Returns {requested title: (exists, resolved title)} for one batch of
+    # titles, following normalization and redirects.
+    request_params = {
         "action": "query",
         "format": "json",
-        "prop": "categories",
-        "titles": entry_name,
+        "prop": "categoryinfo",
+        "titles": "|".join(titles),
+        "redirects": "1",
         "formatversion": "2",
     }
 
-    article_check_resp = requests.get(
-        "https://en.wikipedia.org/w/api.php", params=article_check_params
+    try:
+        js = await http_client.get_json(config.wiki_api_url(), params=request_params)
+    except http_client.HttpError as err:
+        print(f"Wiki API request failed: {err}")
+        return {}
+
+    if "query" not in js:
+        print(f"Got unexpected response from wiki API: {js}")
+        return {}
+
+    # API-normalized titles (e.g. first-letter capitalization), then redirects.
+    normalized = {n["from"]: n["to"] for n in js["query"].get("normalized", [])}
+    redirects = {r["from"]: r["to"] for r in js["query"].get("redirects", [])}
+    pages = {page["title"]: page for page in js["query"].get("pages", [])}
+
+    found = {}
+
+    for title in titles:
+        resolved = normalized.get(title, title)
+        resolved = redirects.get(resolved, resolved)
+        page = pages.get(resolved)
+
+        if page is None:
+            continue
+
+        # Categories can have members without having a category page.
+        exists = not page.get("missing", False) and not page.get("invalid", False)
+        exists = exists or page.get("categoryinfo", {}).get("size", 0) > 0
+
+        found[title] = (exists, resolved)
+
+    return found
+
+
+async def resolve_entries(entry_names: List[str]) -> Dict[str, Tuple[str, str | None]]:
+    # {name: (entry type, the title it resolves to)}, following normalization
+    # and redirects. Names that aren't found are ("err", None).
+    return await _entry_lookups.do_many(entry_names, _lookup_entries)
+
+
+async def entry_types(entry_names: List[str]) -> Dict[str, str]:
+    return {
+        name: entry_type
+        for name, (entry_type, _) in (await resolve_entries(entry_names)).items()
+    }
+
+
+async def _lookup_entries(names: List[str]) -> Dict[str, Tuple[str, str | None]]:
+    import db
+
+    # Names the offline dump index knows about never reach the API, and
+    # neither do names looked up recently, found or not.
+    resolved = {
+        name: (entry_type, name) for name, entry_type in db.dump_entry_types(names).items()
+    }
+    resolved.update(db.cached_entry_lookups([name for name in names if name not in resolved]))
+    names = [name for name in names if name not in resolved]
+
+    if len(names) == 0:
+        return resolved
+
+    names_per_query = MAX_TITLES_PER_QUERY // 2
+
+    batches = await asyncio.gather(
+        *[
+            _resolve_titles([f"Category:{name}" for name in chunk] + chunk)
+            for chunk in _chunks(names, names_per_query)
+        ]
     )
-    article_check_json = article_check_resp.json()
 
-    if "query" in article_check_json and (
-        "missing" not in article_check_json["query"]["pages"][0]
-    ):
-        return "article"
+    found = {}
+    for batch in batches:
+        found.update(batch)
+
+    lookups = []
+
+    for name in names:
+        (is_category, category_title) = found.get(f"Category:{name}", (False, None))
+        (is_article, article_title) = found.get(name, (False, None))
+
+        if is_category:
+            entry_type = "category"
+            target = category_title.removeprefix("Category:")
+        elif is_article:
+            entry_type = "article"
+            target = article_title
+        else:
+            entry_type = "err"
+            target = None
+
+        resolved[name] = (entry_type, target)
+
+        # A failed request isn't an answer, don't cache it.
+        if entry_type == "err" and (f"Category:{name}" not in found or name not in found):
+            continue
+
+        lookups.append((name, entry_type, target))
+
+        # Whatever the name resolved to is known to be valid as well.
+        if target is not None and target != name:
+            lookups.append((target, entry_type, target))
+
+    db.record_entry_lookups(lookups)
+
+    return resolved
+
 
-    return "err"
+async def entry_type(entry_name: str) -> str:
+    return (await entry_types([entry_name]))[entry_name]
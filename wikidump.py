@@ -0,0 +1,232 @@
+import argparse
+import gzip
+import re
+import time
+
+from typing import Dict, Iterator, List, TextIO
+
+import db
+
+# Namespaces we keep from the dumps: articles and categories.
+ARTICLE_NAMESPACE = 0
+CATEGORY_NAMESPACE = 14
+
+BATCH_SIZE = 50_000
+
+# One token of a MySQL extended INSERT: a paren, a quoted string (with
+# backslash escapes), or a bare number/NULL.
+_VALUE_TOKEN = re.compile(r"([()])|'((?:[^'\\]|\\.)*)'|([^,()'\s;]+)", re.S)
+_ESCAPE = re.compile(r"\\(.)", re.S)
+_ESCAPES = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+_COLUMN = re.compile(r"^\s*`(\w+)`")
+
+
+class DumpImportError(Exception):
+    pass
+
+
+def _unescape(s: str) -> str:
+    if "\\" not in s:
+        return s
+
+    return _ESCAPE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), s)
+
+
+def open_dump(path: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def parse_values(statement: str) -> Iterator[List[str | None]]:
+    # Yields each row tuple of an `INSERT INTO ... VALUES (...),(...);` line.
+    start = statement.find(" VALUES ")
+    if start < 0:
+        return
+
+    row = None
+
+    for paren, quoted, bare in _VALUE_TOKEN.findall(statement, start + 8):
+        if paren == "(":
+            row = []
+        elif paren == ")":
+            yield row
+            row = None
+        elif row is None:
+            continue
+        elif bare:
+            row.append(None if bare == "NULL" else bare)
+        else:
+            row.append(_unescape(quoted))
+
+
+def iter_dump_rows(path: str) -> Iterator[Dict[str, str | None]]:
+    # Streams a mysqldump file one INSERT line at a time, mapping each row onto
+    # the column names from its CREATE TABLE, so column order changes between
+    # dump versions don't matter.
+    columns = []
+    in_create = False
+
+    with open_dump(path) as infile:
+        for line in infile:
+            if line.startswith("CREATE TABLE"):
+                columns = []
+                in_create = True
+            elif in_create:
+                match = _COLUMN.match(line)
+                if match:
+                    columns.append(match.group(1))
+                elif line.startswith(")"):
+                    in_create = False
+            elif line.startswith("INSERT INTO"):
+                for row in parse_values(line):
+                    yield dict(zip(columns, row))
+
+
+def _title(raw: str) -> str:
+    return raw.replace("_", " ")
+
+
+def _flush(conn, statement: str, batch: list) -> int:
+    # Returns the number of rows actually written, which for INSERT ... SELECT
+    # can be fewer than the batch.
+    before = conn.total_changes
+
+    with conn:
+        conn.executemany(statement, batch)
+
+    batch.clear()
+
+    return conn.total_changes - before
+
+
+def import_linktargets(path: str) -> int:
+    # Newer categorylinks dumps point at linktarget ids instead of titles.
+    conn = db.connection()
+    statement = (
+        "INSERT OR REPLACE INTO DumpLinkTargets(lt_id, title) VALUES(?, ?)"
+    )
+    batch = []
+    total = 0
+
+    for row in iter_dump_rows(path):
+        if int(row["lt_namespace"]) != CATEGORY_NAMESPACE:
+            continue
+
+        batch.append((int(row["lt_id"]), _title(row["lt_title"])))
+
+        if len(batch) >= BATCH_SIZE:
+            total += _flush(conn, statement, batch)
+
+    return total + _flush(conn, statement, batch)
+
+
+def import_pages(path: str) -> int:
+    conn = db.connection()
+    statement = (
+        "INSERT OR REPLACE INTO DumpPages(page_id, namespace, title, is_redirect) "
+        "VALUES(?, ?, ?, ?)"
+    )
+    batch = []
+    total = 0
+
+    for row in iter_dump_rows(path):
+        namespace = int(row["page_namespace"])
+
+        if namespace not in (ARTICLE_NAMESPACE, CATEGORY_NAMESPACE):
+            continue
+
+        batch.append(
+            (
+                int(row["page_id"]),
+                namespace,
+                _title(row["page_title"]),
+                int(row.get("page_is_redirect") or 0),
+            )
+        )
+
+        if len(batch) >= BATCH_SIZE:
+            total += _flush(conn, statement, batch)
+
+    return total + _flush(conn, statement, batch)
+
+
+def _has_link_targets(conn) -> bool:
+    return len(list(conn.execute("SELECT 1 FROM DumpLinkTargets LIMIT 1"))) > 0
+
+
+def import_categorylinks(path: str) -> int:
+    conn = db.connection()
+    by_title = (
+        "INSERT OR IGNORE INTO DumpCategoryLinks(cl_from, cl_to, cl_type) "
+        "VALUES(?, ?, ?)"
+    )
+    by_target = (
+        "INSERT OR IGNORE INTO DumpCategoryLinks(cl_from, cl_to, cl_type) "
+        "SELECT ?, title, ? FROM DumpLinkTargets WHERE lt_id = ?"
+    )
+    statement = None
+    batch = []
+    total = 0
+
+    for row in iter_dump_rows(path):
+        if row["cl_type"] not in ("page", "subcat"):
+            continue
+
+        if "cl_to" in row:
+            statement = by_title
+            batch.append((int(row["cl_from"]), _title(row["cl_to"]), row["cl_type"]))
+        else:
+            if statement is None and not _has_link_targets(conn):
+                raise DumpImportError(
+                    f"{path} uses cl_target_id, import its linktarget dump first (--linktarget)"
+                )
+
+            statement = by_target
+            batch.append((int(row["cl_from"]), row["cl_type"], int(row["cl_target_id"])))
+
+        if len(batch) >= BATCH_SIZE:
+            total += _flush(conn, statement, batch)
+
+    if len(batch) > 0:
+        total += _flush(conn, statement, batch)
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the offline category index in wiki.db from Wikipedia SQL dumps."
+    )
+    parser.add_argument("--page", required=True, help="page.sql[.gz]")
+    parser.add_argument("--categorylinks", required=True, help="categorylinks.sql[.gz]")
+    parser.add_argument(
+        "--linktarget",
+        help="linktarget.sql[.gz], needed for dumps whose categorylinks use cl_target_id",
+    )
+    args = parser.parse_args()
+
+    db.migrate_db()
+    # Bulk load: durability of a half-finished import doesn't matter.
+    db.connection().execute("PRAGMA synchronous=OFF")
+
+    started = time.monotonic()
+
+    if args.linktarget:
+        print(f"Imported {import_linktargets(args.linktarget)} link targets")
+
+    print(f"Imported {import_pages(args.page)} pages")
+
+    try:
+        print(f"Imported {import_categorylinks(args.categorylinks)} category links")
+    except DumpImportError as err:
+        parser.exit(1, f"{err}\n")
+
+    db.dump_index_changed()
+
+    print(f"Done in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()